@@ -1,15 +1,28 @@
 # bot.py
+import time
+_BOOT_STARTED = time.perf_counter()   # لقياس زمن الإقلاع من أول سطر
+
 import os
 import re
 import sys
 import io
+import csv
 import json
-import time
+import signal
 import asyncio
 import threading
+import mmap
+import pickle
+import struct
+import hashlib
+import sqlite3
+import tempfile
 import subprocess
-import pandas as pd
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse
 from telegram import (
     Update,
@@ -25,9 +38,13 @@ from telegram.ext import (
     MessageHandler,
     ContextTypes,
     CallbackQueryHandler,
+    BasePersistence,
+    BaseUpdateProcessor,
+    PersistenceInput,
     filters,
 )
-from PyPDF2 import PdfReader, PdfWriter
+from telegram.error import BadRequest
+# ⚡ PyPDF2 يُستورد داخل الدوال عند أول حاجة فعلية (فهرسة أو تجهيز ملف) لتسريع الإقلاع
 
 # ضمان طباعة عربية مباشرة
 try:
@@ -47,11 +64,8 @@ FILES = {
     "ids": "IDs.csv",
 }
 
-# ✅ استخدم متغير البيئة TELEGRAM_TOKEN
+# ✅ استخدم متغير البيئة TELEGRAM_TOKEN (يُتحقق منه عند تشغيل البوت فقط، لا في وضع التجهيز المسبق)
 BOT_TOKEN = os.environ.get("TELEGRAM_TOKEN")
-if not BOT_TOKEN:
-    print("❌ لم يتم العثور على متغير TELEGRAM_TOKEN. ضعه في إعدادات الخادم أو عرّفه محليًا للتجربة.", flush=True)
-    sys.exit(1)
 
 # =========================
 # حالة البوت (تُعرض للداثبورد)
@@ -74,6 +88,92 @@ def _get_status():
     with _status_lock:
         return dict(STATUS)
 
+# =========================
+# قياس زمن الطلبات ومعدلات الكاش (تُعرض عبر /metrics بصيغة Prometheus)
+# =========================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_histograms = {}   # (الخدمة، المرحلة) -> [عدادات الحدود، المجموع، العدد]
+_counters = {}     # (الاسم، الوسوم) -> القيمة
+_metrics_lock = threading.Lock()
+_requests_in_flight = 0
+
+def observe_latency(service, stage, seconds):
+    with _metrics_lock:
+        hist = _histograms.get((service, stage))
+        if hist is None:
+            hist = _histograms[(service, stage)] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                hist[0][i] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+def inc_counter(name, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+def count_cache(cache, hit):
+    inc_counter("bot_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+@contextmanager
+def timed(service, stage):
+    """قياس زمن مرحلة من مراحل الطلب (lookup / assembly / compression / upload / total)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_latency(service, stage, time.perf_counter() - start)
+
+def _format_labels(labels):
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+def render_metrics():
+    """نص المقاييس بصيغة Prometheus."""
+    lines = [
+        "# HELP bot_request_duration_seconds Request latency per service and stage.",
+        "# TYPE bot_request_duration_seconds histogram",
+    ]
+    with _metrics_lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        in_flight = _requests_in_flight
+
+    for (service, stage), (buckets, total, count) in sorted(histograms.items()):
+        labels = f'service="{service}",stage="{stage}"'
+        for bound, value in zip(LATENCY_BUCKETS, buckets):
+            lines.append(f'bot_request_duration_seconds_bucket{{{labels},le="{bound}"}} {value}')
+        lines.append(f'bot_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f"bot_request_duration_seconds_sum{{{labels}}} {total:.6f}")
+        lines.append(f"bot_request_duration_seconds_count{{{labels}}} {count}")
+
+    names = sorted({name for name, _ in counters})
+    for name in names:
+        lines.append(f"# TYPE {name} counter")
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{name}{{{_format_labels(labels)}}} {value}")
+
+    with _demand_lock:
+        index_waiters = sum(_index_demand.values())
+    gauges = {
+        "bot_requests_in_flight": in_flight,
+        "bot_ghostscript_queue_depth": _gs_waiting,
+        "bot_ghostscript_active": _gs_active,
+        "bot_index_waiters": index_waiters,
+        "bot_heavy_lane_waiting": _heavy_waiting,
+        "bot_light_lane_waiting": _light_waiting,
+        "bot_indexing": int(_get_status().get("indexing", False)),
+    }
+    for name, value in gauges.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    lines.append("# TYPE bot_index_ready gauge")
+    for name, event in INDEX_READY.items():
+        lines.append(f'bot_index_ready{{index="{name}"}} {int(event.is_set())}')
+    return "\n".join(lines) + "\n"
+
 # =========================
 # أدوات مساعدة
 # =========================
@@ -130,39 +230,308 @@ def extract_first_name(full_name: str) -> str:
 # =========================
 INDEXES = {
     "schedule": {},
-    "advisor": None,
+    "advisor": {},
     "remaining": {},
     "gpa": {},
     "majors": {},
     "ids": {},
 }
 
+# =========================
+# جاهزية الفهارس (انتظار محدود بدل رد "لم يتم العثور" أثناء الفهرسة)
+# =========================
+INDEX_WAIT_TIMEOUT = float(os.environ.get("INDEX_WAIT_TIMEOUT", "20"))   # أقصى انتظار لطلب واحد بالثواني
+INDEX_FILE_CONCURRENCY = max(1, int(os.environ.get("INDEX_FILE_CONCURRENCY", "2")))   # ملفات تُفهرس معًا
+# الترتيب الافتراضي للفهرسة؛ الفهارس التي ينتظرها مستخدمون تتقدم عليه
+INDEX_PRIORITY = ("ids", "schedule", "remaining", "advisor", "gpa", "majors")
+
+INDEX_READY = {name: threading.Event() for name in INDEXES}
+_index_demand = {name: 0 for name in INDEXES}   # عدد الطلبات المنتظرة لكل فهرس
+_demand_lock = threading.Lock()
+
+# نسخة ملفات المصدر التي بُني منها كل فهرس: {المسار: النسخة}، تُستبدل مع الفهرس نفسه تحت _index_swap_lock
+INDEX_VERSIONS = {}
+_index_swap_lock = threading.Lock()
+# فهارس تُقتطع بها صفحات من ملف المصدر: لا تصلح إلا لنفس نسخة الملف التي بُنيت منها
+PAGE_INDEXES = ("schedule", "remaining")
+
+def _mark_ready(name):
+    INDEX_READY[name].set()
+
+def _index_usable(name):
+    """
+    الفهرس جاهز للاستخدام؟ فهارس الصفحات تُعامل كغير جاهزة ما دام ملف المصدر الحالي
+    يختلف عن النسخة التي بُنيت منها (ملف جديد لم يُعد فهرسته بعد)، حتى لا تُقتطع صفحات متدرب آخر.
+    """
+    if not INDEX_READY[name].is_set():
+        return False
+    if name not in PAGE_INDEXES:
+        return True
+    try:
+        return _index_fingerprint(name) == INDEX_VERSIONS.get(name)
+    except OSError:
+        return False
+
+def _next_index_to_build(pending):
+    with _demand_lock:
+        return max(pending, key=lambda n: (_index_demand[n], -INDEX_PRIORITY.index(n)))
+
+async def wait_for_index(name, timeout=None):
+    """انتظار جاهزية الفهرس (دون حجب حلقة asyncio) حتى المهلة؛ النتيجة: هل أصبح جاهزًا."""
+    if _index_usable(name):
+        return True
+    timeout = INDEX_WAIT_TIMEOUT if timeout is None else timeout
+    with _demand_lock:
+        _index_demand[name] += 1
+    try:
+        deadline = time.monotonic() + timeout
+        while not _index_usable(name) and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        return _index_usable(name)
+    finally:
+        with _demand_lock:
+            _index_demand[name] -= 1
+
+# =========================
+# حفظ الفهارس على القرص (ملف .meta يحوي بصمة محتوى المصدر)
+# =========================
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_digest_cache = {}   # المسار -> ((mtime_ns, الحجم)، البصمة)
+_digest_lock = threading.Lock()
+
+def _file_digest(path):
+    """
+    بصمة SHA-256 لمحتوى الملف، تُقرأ على أجزاء دون تحميل الملف كاملًا في الذاكرة.
+    تُحفظ في الذاكرة ما دام mtime والحجم دون تغيير، فلا يُعاد الحساب مع كل طلب.
+    """
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _digest_lock:
+        cached = _digest_cache.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_cache[path] = (stamp, digest)
+    return digest
+
+def _source_version(path):
+    """نسخة ملف المصدر مبنية على محتواه (لا تتغير بمجرد تغيّر mtime بعد النشر)."""
+    return _file_digest(path)[:16]
+
+def _source_meta(src_paths):
+    if isinstance(src_paths, str):
+        src_paths = [src_paths]
+    meta = {}
+    for path in src_paths:
+        if os.path.exists(path):
+            st = os.stat(path)
+            meta[path] = {"mtime": st.st_mtime, "size": st.st_size, "sha256": _file_digest(path)}
+    return meta
+
+def _load_cached_index(src_path, index_path):
+    """
+    إرجاع الفهرس المحفوظ إن كان محتوى ملف (ملفات) المصدر لم يتغير، وإلا None.
+    تطابق mtime والحجم يكفي كفحص سريع؛ وإلا نقارن بصمة المحتوى (وتُحدَّث الـ meta إن تطابقت).
+    """
+    meta_path = index_path + ".meta"
+    if isinstance(src_path, str):
+        src_path = [src_path]
+    sources = [p for p in src_path if os.path.exists(p)]
+    if not sources or not (os.path.exists(index_path) and os.path.exists(meta_path)):
+        return None
+    try:
+        with open(meta_path, "r") as m:
+            meta = json.loads(m.read())
+        if not isinstance(meta, dict) or set(meta.get("sources", {})) != set(sources):
+            # meta بالصيغة القديمة (mtime فقط) أو مصادر مختلفة: إعادة البناء مرة واحدة
+            return None
+
+        touched = False
+        for path in sources:
+            recorded = meta["sources"][path]
+            st = os.stat(path)
+            if st.st_mtime == recorded["mtime"] and st.st_size == recorded["size"]:
+                continue
+            if st.st_size != recorded["size"] or _file_digest(path) != recorded["sha256"]:
+                return None
+            touched = True   # نفس المحتوى بـ mtime مختلف (مثل git checkout عند النشر)
+
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if touched:
+            with open(meta_path, "w") as m:
+                json.dump({"sources": _source_meta(sources)}, m)
+        return index
+    except Exception as e:
+        print(f"⚠️ تعذر قراءة الفهرس المحفوظ {index_path}: {e}", flush=True)
+        return None
+
+def _save_index(src_path, index_path, index):
+    try:
+        with open(index_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        with open(index_path + ".meta", "w") as m:
+            json.dump({"sources": _source_meta(src_path)}, m)
+    except Exception as e:
+        print(f"⚠️ تعذر حفظ الفهرس {index_path}: {e}", flush=True)
+
+# =========================
+# تقدم الفهرسة (عدة ملفات بالتوازي)
+# =========================
+_index_progress = {}   # اسم الملف -> نسبة التقدم
+_progress_lock = threading.Lock()
+
+def _publish_progress():
+    # يُستدعى مع قفل التقدم: نعرض الملفات الجارية ومتوسط تقدمها
+    if _index_progress:
+        _set_status(
+            indexing=True,
+            current_file=", ".join(_index_progress),
+            index_progress=sum(_index_progress.values()) / len(_index_progress),
+        )
+    else:
+        _set_status(indexing=False, current_file="", index_progress=0.0)
+
+def _begin_progress(name):
+    with _progress_lock:
+        _index_progress[name] = 0.0
+        _publish_progress()
+
+def _report_progress(name, percent):
+    with _progress_lock:
+        if name in _index_progress:
+            _index_progress[name] = percent
+            _publish_progress()
+
+def _end_progress(name):
+    with _progress_lock:
+        _index_progress.pop(name, None)
+        _publish_progress()
+
+# =========================
+# محرك الفهرسة المتوازية (تقسيم الصفحات على عمليات منفصلة)
+# =========================
+INDEX_WORKERS = max(1, int(os.environ.get("INDEX_WORKERS", os.cpu_count() or 1)))
+CHUNKS_PER_WORKER = 4   # عدة أجزاء لكل عملية لتوزيع أفضل وتقدم أدق
+
+_index_pool = None
+_index_pool_lock = threading.Lock()
+
+def _get_index_pool():
+    """مجمع عمليات مشترك بين كل الملفات (يُنشأ عند الحاجة فقط)."""
+    global _index_pool
+    with _index_pool_lock:
+        if _index_pool is None:
+            # forkserver/spawn بدل fork لأن العملية الرئيسية تحوي خيوطًا (asyncio + الفهرسة)
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _index_pool = ProcessPoolExecutor(max_workers=INDEX_WORKERS, mp_context=ctx)
+        return _index_pool
+
+def _shutdown_index_pool():
+    global _index_pool
+    with _index_pool_lock:
+        if _index_pool is not None:
+            _index_pool.shutdown(wait=True)
+            _index_pool = None
+
+def _scan_pages(pdf_path, start, end, mode):
+    """
+    تُنفَّذ داخل عملية فرعية: استخراج نص الصفحات [start, end) وإرجاع المطلوب فقط.
+    mode: "ids" أرقام المتدربين في الصفحة، "gpa" أزواج (رقم، معدل) من الأسطر،
+          "majors" (أرقام المتدربين، ملف الخطة المطابق لنص الصفحة).
+    """
+    from PyPDF2 import PdfReader
+    reader = PdfReader(pdf_path)
+    results = []
+    for i in range(start, end):
+        text = reader.pages[i].extract_text() or ""
+        if mode == "ids":
+            payload = re.findall(r"\b44\d{7}\b", text)
+        elif mode == "gpa":
+            payload = []
+            for line in text.splitlines():
+                match = re.search(r"\b\d\.\d{2}\b", line)
+                if match:
+                    payload.extend((sid, match.group(0)) for sid in re.findall(r"\b44\d{7}\b", line))
+        else:
+            payload = (re.findall(r"\b44\d{7}\b", text), _resolve_plan(text))
+        results.append((i, payload))
+    return results
+
+def _parallel_scan(pdf_path, mode):
+    """
+    مسح كل صفحات الملف بتوزيعها على مجمع العمليات، مع تحديث التقدم عند اكتمال كل جزء.
+    النتيجة: (قائمة [(رقم الصفحة، الناتج)] مرتبة حسب الصفحة، عدد الصفحات).
+    """
+    from PyPDF2 import PdfReader
+    name = os.path.basename(pdf_path)
+    total_pages = len(PdfReader(pdf_path).pages)
+    if total_pages == 0:
+        return [], 0
+
+    chunk = max(1, -(-total_pages // (INDEX_WORKERS * CHUNKS_PER_WORKER)))
+    ranges = [(s, min(s + chunk, total_pages)) for s in range(0, total_pages, chunk)]
+
+    results = []
+    if INDEX_WORKERS == 1 or len(ranges) == 1:
+        for s, e in ranges:
+            results.extend(_scan_pages(pdf_path, s, e, mode))
+            _report_progress(name, e / total_pages * 100)
+    else:
+        pool = _get_index_pool()
+        futures = [pool.submit(_scan_pages, pdf_path, s, e, mode) for s, e in ranges]
+        for fut in as_completed(futures):
+            results.extend(fut.result())
+            percent = len(results) / total_pages * 100
+            _report_progress(name, percent)
+            print(f"📄 فهرسة {name}: {len(results)}/{total_pages} صفحة ({percent:.1f}%)", flush=True)
+
+    results.sort(key=lambda r: r[0])
+    return results, total_pages
+
 # =========================
 # فهرسة PDF (مع تقدم لحظي)
 # =========================
+def _schedule_ranges(starts, total_pages):
+    """تحويل صفحة البداية لكل متدرب إلى مدى [البداية، النهاية) حيث النهاية بداية المتدرب التالي."""
+    ordered = sorted(set(starts.values()))
+    next_start = dict(zip(ordered, ordered[1:] + [total_pages]))
+    return {sid: [start, next_start[start]] for sid, start in starts.items()}
+
 def build_index(pdf_path, index_path="schedule_index.json"):
-    """فهرسة ملف الجدول (Schedule) لاستخراج مواقع المتدربين حسب أرقامهم."""
-    _set_status(indexing=True, current_file=os.path.basename(pdf_path), index_progress=0.0)
-    try:
-        if not os.path.exists(pdf_path):
-            print(f"⚠️ الملف {pdf_path} غير موجود.", flush=True)
-            return {}
+    """فهرسة ملف الجدول (Schedule): {"رقم المتدرب": [صفحة البداية، صفحة النهاية (غير شاملة)]}."""
+    if not os.path.exists(pdf_path):
+        print(f"⚠️ الملف {pdf_path} غير موجود.", flush=True)
+        return {}
 
+    cached = _load_cached_index(pdf_path, index_path)
+    if cached is not None and all(isinstance(v, list) and len(v) == 2 for v in cached.values()):
+        print(f"✅ فهرس {pdf_path} جاهز مسبقًا.", flush=True)
+        return cached
+
+    name = os.path.basename(pdf_path)
+    _begin_progress(name)
+    try:
         print(f"⏳ فهرسة الملف: {pdf_path}", flush=True)
-        reader = PdfReader(pdf_path)
-        total_pages = len(reader.pages)
-        index = {}
         start_time = time.time()
+        pages, total_pages = _parallel_scan(pdf_path, "ids")
+
+        starts = {}
+        for i, sids in pages:
+            for m in sids:
+                if m not in starts:
+                    starts[m] = i
 
-        for i, page in enumerate(reader.pages, start=1):
-            text = page.extract_text() or ""
-            for m in re.findall(r"\b44\d{7}\b", text):
-                if m not in index:
-                    index[m] = i - 1
-            percent = (i / total_pages) * 100
-            _set_status(index_progress=percent)
-            print(f"📄 فهرسة الصفحة {i}/{total_pages} ({percent:.1f}%)", flush=True)
-            time.sleep(0.01)
+        index = _schedule_ranges(starts, total_pages)
+        _save_index(pdf_path, index_path, index)
 
         elapsed = time.time() - start_time
         print(f"✅ تم فهرسة {len(index)} متدرب من {pdf_path} خلال {elapsed:.1f} ثانية.", flush=True)
@@ -170,42 +539,34 @@ def build_index(pdf_path, index_path="schedule_index.json"):
     except Exception as e:
         print("❌ خطأ أثناء فهرسة الجدول:", e, flush=True)
         import traceback; traceback.print_exc()
-        return {}
+        return None
     finally:
-        _set_status(indexing=False, current_file="", index_progress=0.0)
+        _end_progress(name)
 
 
 def build_remaining_index(pdf_path, index_path="remaining_index.json"):
-    _set_status(indexing=True, current_file=os.path.basename(pdf_path), index_progress=0.0)
-    try:
-        meta_path = index_path + ".meta"
-        if os.path.exists(index_path) and os.path.exists(meta_path):
-            pdf_mtime = os.path.getmtime(pdf_path)
-            meta_mtime = float(open(meta_path, "r").read())
-            if pdf_mtime <= meta_mtime:
-                print(f"✅ فهرس {pdf_path} جاهز مسبقًا.", flush=True)
-                with open(index_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
+    if not os.path.exists(pdf_path):
+        print(f"⚠️ الملف {pdf_path} غير موجود.", flush=True)
+        return {}
 
+    cached = _load_cached_index(pdf_path, index_path)
+    if cached is not None:
+        print(f"✅ فهرس {pdf_path} جاهز مسبقًا.", flush=True)
+        return cached
+
+    name = os.path.basename(pdf_path)
+    _begin_progress(name)
+    try:
         print(f"⏳ فهرسة (remaining) الملف: {pdf_path}", flush=True)
-        reader = PdfReader(pdf_path)
-        total_pages = len(reader.pages)
-        index = {}
         start_time = time.time()
+        pages, _ = _parallel_scan(pdf_path, "ids")
 
-        for i, page in enumerate(reader.pages, start=1):
-            text = page.extract_text() or ""
-            for match in re.findall(r"\b44\d{7}\b", text):
-                index.setdefault(match, []).append(i - 1)
-            percent = (i / total_pages) * 100
-            _set_status(index_progress=percent)
-            print(f"فهرسة remaining: الصفحة {i}/{total_pages} ({percent:.1f}%)", flush=True)
-            time.sleep(0.01)
+        index = {}
+        for i, sids in pages:
+            for match in sids:
+                index.setdefault(match, []).append(i)
 
-        with open(index_path, "w", encoding="utf-8") as f:
-            json.dump(index, f, ensure_ascii=False)
-        with open(meta_path, "w") as m:
-            m.write(str(os.path.getmtime(pdf_path)))
+        _save_index(pdf_path, index_path, index)
 
         elapsed = time.time() - start_time
         print(f"✅ تم بناء فهرس remaining ({len(index)} متدرب) خلال {elapsed:.1f} ثانية.", flush=True)
@@ -213,16 +574,103 @@ def build_remaining_index(pdf_path, index_path="remaining_index.json"):
     except Exception as e:
         print("❌ خطأ أثناء فهرسة remaining:", e, flush=True)
         import traceback; traceback.print_exc()
-        return {}
+        return None
     finally:
-        _set_status(indexing=False, current_file="", index_progress=0.0)
+        _end_progress(name)
+
+class StudentRecord:
+    """سجل متدرب مختصر (__slots__ بدل قاموس لكل متدرب لتقليل الذاكرة)."""
+    __slots__ = ("nid", "name", "gpa", "program")
+
+    def __init__(self, nid, name, gpa, program):
+        self.nid = nid
+        self.name = name
+        self.gpa = gpa
+        self.program = program
+
+
+def _students_footprint(index):
+    """تقدير حجم مخزن المتدربين في الذاكرة بالبايت (القاموس + السجلات + النصوص)."""
+    total = sys.getsizeof(index)
+    for sid, rec in index.items():
+        total += sys.getsizeof(sid) + sys.getsizeof(rec)
+        total += sum(sys.getsizeof(getattr(rec, f)) for f in StudentRecord.__slots__)
+    return total
+
+
+# ⚡ وضع الإقلاع السريع: قراءة ملفات CSV بوحدة csv القياسية بدل استيراد pandas
+FAST_START = os.environ.get("FAST_START", "0") == "1"
+
+def _read_csv_rows(f):
+    """
+    صفوف ملف CSV كقوائم نصوص. بعض الملفات المصدَّرة تضع كل سطر داخل علامتي تنصيص
+    فيُقرأ كحقل واحد؛ في هذه الحالة يُعاد تحليل الحقل نفسه كسطر CSV.
+    """
+    rows = csv.reader(f)
+    first = next(rows, None)
+    if first is None:
+        return iter(())
+    if len(first) == 1 and "," in first[0]:
+        return (next(csv.reader([row[0]]), []) for row in _chain_first(first, rows) if row)
+    return _chain_first(first, rows)
+
+def _chain_first(first, rows):
+    yield first
+    yield from rows
+
+def _load_ids_pandas(csv_path):
+    """القراءة الأساسية: التحقق من الأرقام يتم على الأعمدة كاملة (vectorized) دون المرور على الصفوف."""
+    import pandas as pd   # يُستورد عند الحاجة فقط حتى لا يتأخر الإقلاع من اللقطة
+    df = pd.read_csv(csv_path, encoding="utf-8-sig", dtype=str, quotechar='"', keep_default_na=False)
+
+    def column(name):
+        if name not in df.columns:
+            return pd.Series("", index=df.index)
+        return df[name].str.strip()
+
+    sids = column("رقم المتدرب")
+    nids = column("السجل المدني")
+    valid = sids.str.fullmatch(r"44\d{7}") & nids.str.fullmatch(r"1\d{9}")
+    df = df[valid]
+
+    return {
+        sid: StudentRecord(nid, name, gpa, sys.intern(program))
+        for sid, nid, name, gpa, program in zip(
+            sids[valid], nids[valid], column("اسم المتدرب"),
+            column("المعدل التراكمي"), column("البرنامج"),
+        )
+    }
+
+def _load_ids_stdlib(csv_path):
+    """وضع الإقلاع السريع (FAST_START): وحدة csv القياسية دون استيراد pandas."""
+    index = {}
+    sid_re = re.compile(r"44\d{7}")
+    nid_re = re.compile(r"1\d{9}")
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        rows = _read_csv_rows(f)
+        header = [h.strip() for h in next(rows, [])]
+        col = {name: i for i, name in enumerate(header)}
+
+        def field(row, name):
+            i = col.get(name)
+            return row[i].strip() if i is not None and i < len(row) else ""
+
+        for row in rows:
+            sid = field(row, "رقم المتدرب")
+            nid = field(row, "السجل المدني")
+            if sid_re.fullmatch(sid) and nid_re.fullmatch(nid):
+                index[sid] = StudentRecord(
+                    nid, field(row, "اسم المتدرب"), field(row, "المعدل التراكمي"),
+                    sys.intern(field(row, "البرنامج")),
+                )
+    return index
 
 def load_ids_from_csv(csv_path: str):
     """
     🔹 تحميل بيانات المتدربين من ملف CSV يحتوي على الأعمدة:
     الفصل التدريبي,"الوحدة التدريبية","المرحلة","القسم","البرنامج",
     "رقم المتدرب","اسم المتدرب","المعدل التراكمي","السجل المدني","الجنس","الجنسية","رقم الجوال"
-    🔸 النتيجة: {"رقم المتدرب": {"nid": "السجل المدني", "name": "اسم المتدرب"}}
+    🔸 النتيجة: {"رقم المتدرب": StudentRecord(nid, name, gpa, program)}، أو None عند فشل القراءة.
     """
     index = {}
     if not os.path.exists(csv_path):
@@ -230,118 +678,504 @@ def load_ids_from_csv(csv_path: str):
         return index
 
     try:
-        df = pd.read_csv(csv_path, encoding="utf-8-sig", dtype=str, quotechar='"')
-        for _, row in df.iterrows():
-            sid = str(row.get("رقم المتدرب", "")).strip()
-            nid = str(row.get("السجل المدني", "")).strip()
-            name = str(row.get("اسم المتدرب", "")).strip()
-            if re.fullmatch(r"44\d{7}", sid) and re.fullmatch(r"1\d{9}", nid):
-                index[sid] = {"nid": nid, "name": name}
-        print(f"✅ تم تحميل بيانات {len(index)} متدرب من CSV بنجاح.", flush=True)
+        start_time = time.time()
+        index = _load_ids_stdlib(csv_path) if FAST_START else _load_ids_pandas(csv_path)
+        elapsed = time.time() - start_time
+        size_kb = _students_footprint(index) / 1024
+        print(f"✅ تم تحميل بيانات {len(index)} متدرب من CSV بنجاح خلال {elapsed:.2f} ثانية (~{size_kb:.0f} KB في الذاكرة).", flush=True)
     except Exception as e:
         print(f"❌ خطأ أثناء قراءة CSV: {e}", flush=True)
         import traceback; traceback.print_exc()
+        return None
 
     return index
 
 
-def build_majors_index(pdf_path, index_path="majors_index.json"):
+def _advisor_rows_pandas(csv_path):
+    import pandas as pd   # يُستورد عند الحاجة فقط
+    df = pd.read_csv(csv_path, encoding="utf-8-sig", dtype=str)
+    # الملف المصدَّر يضع كل سطر داخل علامتي تنصيص، فيُقرأ كعمود واحد؛ نعيد تحليله كـ CSV
+    if len(df.columns) == 1:
+        lines = [df.columns[0]] + df.iloc[:, 0].dropna().tolist()
+        df = pd.read_csv(io.StringIO("\n".join(lines)), dtype=str)
+    df.columns = df.columns.str.strip()
+
+    return zip(*(df[name].fillna("").str.strip() for name in ("رقم المتدرب", "رقم المرشد", "اسم المرشد", "حالة المرشد")))
+
+def _advisor_rows_stdlib(csv_path):
+    """وضع الإقلاع السريع (FAST_START): (رقم المتدرب، رقم المرشد، اسم المرشد، الحالة) لكل صف."""
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        rows = _read_csv_rows(f)
+        header = [h.strip() for h in next(rows, [])]
+        col = {name: i for i, name in enumerate(header)}
+        positions = [col["رقم المتدرب"], col["رقم المرشد"], col["اسم المرشد"], col["حالة المرشد"]]
+        width = max(positions) + 1
+
+        for row in rows:
+            if len(row) >= width:
+                yield tuple(row[i].strip() for i in positions)
+
+def build_advisor_index(csv_path, index_path="advisor_index.json"):
+    """
+    🔹 فهرسة ملف المرشدين مرة واحدة بدل قراءته مع كل طلب.
+    🔸 النتيجة: {"رقم المتدرب": {"advisor_id": "رقم المرشد", "advisor_name": "اسم المرشد", "advisor_status": "حالة المرشد"}}
+    """
+    if not os.path.exists(csv_path):
+        print(f"⚠️ ملف المرشدين غير موجود: {csv_path}", flush=True)
+        return {}
+
+    cached = _load_cached_index(csv_path, index_path)
+    if cached is not None:
+        print(f"✅ فهرس {csv_path} جاهز مسبقًا.", flush=True)
+        return cached
+
     try:
-        meta_path = index_path + ".meta"
-        if os.path.exists(index_path) and os.path.exists(meta_path):
-            pdf_mtime = os.path.getmtime(pdf_path)
-            meta_mtime = float(open(meta_path, "r").read())
-            if pdf_mtime <= meta_mtime:
-                print("✅ فهرس التخصصات جاهز مسبقًا.", flush=True)
-                with open(index_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
+        index = {}
+        for sid, adv_id, name, status in (_advisor_rows_stdlib if FAST_START else _advisor_rows_pandas)(csv_path):
+            if sid and name and sid not in index:
+                index[sid] = {"advisor_id": adv_id, "advisor_name": name, "advisor_status": status}
+
+        _save_index(csv_path, index_path, index)
+        print(f"✅ تم بناء فهرس المرشدين ({len(index)} متدرب).", flush=True)
+        return index
+    except Exception as e:
+        print("❌ خطأ أثناء فهرسة المرشدين:", e, flush=True)
+        import traceback; traceback.print_exc()
+        return None
+
+
+def build_gpa_index(pdf_path, csv_path, index_path="gpa_index.json", students=None):
+    """
+    🔹 فهرسة المعدلات مرة واحدة: من GPA.pdf أولًا ثم عمود "المعدل التراكمي" في IDs.csv لمن لم يُعثر عليه.
+    🔹 students: مخزن المتدربين المحمّل مسبقًا من IDs.csv (يُحمّل من الملف إن لم يُمرَّر).
+    🔸 النتيجة: {"رقم المتدرب": "المعدل"}، أو None إذا فشلت قراءة GPA.pdf (لا يُحفظ شيء).
+    """
+    sources = [p for p in (pdf_path, csv_path) if os.path.exists(p)]
+    if not sources:
+        print(f"⚠️ لا يوجد مصدر للمعدلات ({pdf_path} / {csv_path}).", flush=True)
+        return {}
+
+    cached = _load_cached_index(sources, index_path)
+    if cached is not None:
+        print("✅ فهرس المعدلات جاهز مسبقًا.", flush=True)
+        return cached
+
+    index = {}
+    start_time = time.time()
+    if os.path.exists(pdf_path):
+        name = os.path.basename(pdf_path)
+        _begin_progress(name)
+        try:
+            print(f"⏳ فهرسة (gpa) الملف: {pdf_path}", flush=True)
+            pages, _ = _parallel_scan(pdf_path, "gpa")
+            for _, pairs in pages:
+                for sid, gpa in pairs:
+                    index.setdefault(sid, gpa)
+        except Exception as e:
+            # لا نحفظ فهرسًا جزئيًا من IDs.csv وحده بـ meta تطابق GPA.pdf، وإلا اختفت معدلات الملف حتى يتغير
+            print("❌ خطأ أثناء فهرسة ملف المعدل:", e, flush=True)
+            import traceback; traceback.print_exc()
+            return None
+        finally:
+            _end_progress(name)
+
+    if os.path.exists(csv_path):
+        if students is None:
+            students = load_ids_from_csv(csv_path)
+            if students is None:
+                return None
+        for sid, rec in students.items():
+            if rec.gpa and sid not in index:
+                index[sid] = rec.gpa
+
+    _save_index(sources, index_path, index)
+    elapsed = time.time() - start_time
+    print(f"✅ تم بناء فهرس المعدلات ({len(index)} متدرب) خلال {elapsed:.1f} ثانية.", flush=True)
+    return index
+
+
+# خرائط العبارات إلى ملفات الخطط
+MAJOR_PHRASES_TO_PLAN = {
+    "قيرتتلارصاتتللانلتتلااييرت": "VocationalSafetyAndHealth.pdf",
+    "لااا لقللتلا رارهترا": "LabsPlan.pdf",
+    "قعرلتلااصلقمتلالرقرل": "HRplan.pdf",
+    "قحرتتفاارتتلالرقت": "EPplan.pdf",
+    "قلرتترغاتتلةمارت": "FoodSafetyPlan.pdf",
+}
+
+def _normalize_spaces(s: str) -> str:
+    return " ".join((s or "").split())
+
+def _resolve_plan(text):
+    """ملف الخطة المطابق لنص صفحة التخصصات، أو "" إن لم تطابق أي عبارة."""
+    text = _normalize_spaces(text)
+    for phrase, plan_file in MAJOR_PHRASES_TO_PLAN.items():
+        if _normalize_spaces(phrase) in text:
+            return plan_file
+    return ""
+
+def build_majors_index(pdf_path, index_path="majors_index.json"):
+    """فهرسة التخصصات: {"رقم المتدرب": "ملف الخطة"} (تُحسم العبارة مرة واحدة وقت الفهرسة)."""
+    if not os.path.exists(pdf_path):
+        print(f"⚠️ الملف {pdf_path} غير موجود.", flush=True)
+        return {}
 
+    cached = _load_cached_index(pdf_path, index_path)
+    plan_files = set(MAJOR_PHRASES_TO_PLAN.values()) | {""}
+    # الصيغة القديمة كانت تحفظ نص الصفحة كاملًا لكل متدرب؛ نعيد بناءها بالصيغة المختصرة
+    if cached is not None and all(v in plan_files for v in cached.values()):
+        print("✅ فهرس التخصصات جاهز مسبقًا.", flush=True)
+        return cached
+
+    name = os.path.basename(pdf_path)
+    _begin_progress(name)
+    try:
         print(f"🔍 بناء فهرس التخصصات {pdf_path} ...", flush=True)
-        reader = PdfReader(pdf_path)
+        pages, _ = _parallel_scan(pdf_path, "majors")
+
         index = {}
-        total_pages = len(reader.pages)
-
-        for i, page in enumerate(reader.pages, start=1):
-            text = page.extract_text() or ""
-            student_ids = re.findall(r"\b44\d{7}\b", text)
-            if student_ids:
-                for sid in student_ids:
-                    index[sid] = text
-            if i % 10 == 0 or i == total_pages:
-                percent = (i / total_pages) * 100
-                print(f"📄 فهرسة الصفحة {i}/{total_pages} ({percent:.1f}%)", flush=True)
-                time.sleep(0.01)
+        for _, (sids, plan_file) in pages:
+            for sid in sids:
+                index[sid] = plan_file
 
-        with open(index_path, "w", encoding="utf-8") as f:
-            json.dump(index, f, ensure_ascii=False)
-        with open(meta_path, "w") as m:
-            m.write(str(os.path.getmtime(pdf_path)))
+        _save_index(pdf_path, index_path, index)
 
         print(f"✅ تم بناء فهرس التخصصات ({len(index)} متدرب).", flush=True)
         return index
     except Exception as e:
         print("❌ خطأ أثناء فهرسة التخصصات:", e, flush=True)
         import traceback; traceback.print_exc()
-        return {}
+        return None
+    finally:
+        _end_progress(name)
 
 
-def initialize_indexes():
-    print("🚀 بدء تشغيل النظام وفهرسة الملفات بالخلفية...", flush=True)
+# =========================
+# لقطة موحّدة لكل الفهارس (تحميل سريع عند التشغيل)
+# =========================
+SNAPSHOT_PATH = os.environ.get("INDEX_SNAPSHOT", "indexes.snapshot")
+SNAPSHOT_MAGIC = b"TVTCIDX"
+SNAPSHOT_VERSION = 1
+
+# ملفات المصدر لكل فهرس: يُبطل القسم إذا تغيرت نسخة أي منها
+INDEX_SOURCES = {
+    "ids": ("ids",),
+    "schedule": ("schedule",),
+    "remaining": ("remaining",),
+    "gpa": ("gpa", "ids"),
+    "majors": ("majors",),
+    "advisor": ("advisor",),
+}
+
+def _index_fingerprint(name):
+    return {
+        FILES[key]: (_source_version(FILES[key]) if os.path.exists(FILES[key]) else None)
+        for key in INDEX_SOURCES[name]
+    }
+
+def _encode_section(name, index):
+    if name == "ids":
+        # نحفظ السجلات كصفوف بسيطة حتى لا تعتمد اللقطة على اسم الوحدة (__main__ أو Bot)
+        return {sid: (r.nid, r.name, r.gpa, r.program) for sid, r in index.items()}
+    return index
+
+def _decode_section(name, data):
+    if name == "ids":
+        return {sid: StudentRecord(nid, name_, gpa, sys.intern(program))
+                for sid, (nid, name_, gpa, program) in data.items()}
+    return data
+
+def _source_stats():
+    """(mtime_ns، الحجم، البصمة) لكل ملف مصدر كما حُسبت؛ تُحفظ في ترويسة اللقطة للفحص السريع عند الإقلاع."""
+    stats = {}
+    for path in FILES.values():
+        if not os.path.exists(path):
+            continue
+        try:
+            _file_digest(path)
+        except OSError:
+            continue
+        with _digest_lock:
+            cached = _digest_cache.get(path)
+        if cached:
+            stats[path] = (cached[0][0], cached[0][1], cached[1])
+    return stats
+
+def _seed_digests(stats):
+    """
+    تعبئة ذاكرة البصمات من ترويسة اللقطة للملفات التي لم يتغير mtime وحجمها،
+    فلا يُعاد حساب SHA-256 لكل ملف مصدر مع كل إقلاع (كما في _load_cached_index).
+    """
+    for path, (mtime_ns, size, digest) in stats.items():
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == (mtime_ns, size):
+            with _digest_lock:
+                _digest_cache.setdefault(path, (stamp, digest))
+
+def save_snapshot(fingerprints):
+    """
+    كتابة كل الفهارس في ملف واحد:
+    MAGIC + رقم الإصدار + طول الترويسة + الترويسة (بصمات المصادر وموقع كل قسم) + الأقسام.
+    """
     try:
-        print("\n📂 فهرسة SCHEDULE ...", flush=True)
-        INDEXES["schedule"] = build_index(FILES["schedule"])
-        time.sleep(0.3)
+        start_time = time.time()
+        sections = {}
+        blobs = []
+        offset = 0
+        for name in INDEX_SOURCES:
+            blob = pickle.dumps(_encode_section(name, INDEXES.get(name) or {}), protocol=pickle.HIGHEST_PROTOCOL)
+            # فهرس فشل بناؤه يُحفظ ببصمة فارغة فلا يُحمَّل كنسخة صالحة في التشغيل القادم
+            sources = {} if name in _failed_indexes else fingerprints[name]
+            sections[name] = {"sources": sources, "offset": offset, "length": len(blob)}
+            blobs.append(blob)
+            offset += len(blob)
+
+        header = pickle.dumps({"sections": sections, "stats": _source_stats()}, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path = SNAPSHOT_PATH + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + struct.pack("<BI", SNAPSHOT_VERSION, len(header)))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, SNAPSHOT_PATH)
+        print(f"💾 تم حفظ لقطة الفهارس ({offset / 1024:.0f} KB) خلال {time.time() - start_time:.2f} ثانية.", flush=True)
+    except Exception as e:
+        print(f"⚠️ تعذر حفظ لقطة الفهارس: {e}", flush=True)
 
-        print("\n📂 فهرسة REMAINING ...", flush=True)
-        INDEXES["remaining"] = build_remaining_index(FILES["remaining"])
-        time.sleep(0.3)
+def load_snapshot():
+    """
+    تحميل أقسام اللقطة التي ما زالت مصادرها دون تغيير إلى INDEXES (قراءة واحدة عبر mmap).
+    النتيجة: أسماء الفهارس التي تم تحميلها.
+    """
+    if not os.path.exists(SNAPSHOT_PATH):
+        return set()
+    loaded = set()
+    start_time = time.time()
+    try:
+        with open(SNAPSHOT_PATH, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            prefix_len = len(SNAPSHOT_MAGIC) + struct.calcsize("<BI")
+            if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                print("⚠️ ملف لقطة الفهارس غير صالح، سيتم تجاهله.", flush=True)
+                return loaded
+            version, header_len = struct.unpack("<BI", mm[len(SNAPSHOT_MAGIC):prefix_len])
+            if version != SNAPSHOT_VERSION:
+                print(f"⚠️ إصدار لقطة الفهارس ({version}) قديم، سيتم تجاهله.", flush=True)
+                return loaded
+
+            header = pickle.loads(mm[prefix_len:prefix_len + header_len])
+            _seed_digests(header.get("stats", {}))
+            base = prefix_len + header_len
+            for name, section in header["sections"].items():
+                if name not in INDEX_SOURCES or section["sources"] != _index_fingerprint(name):
+                    continue
+                start = base + section["offset"]
+                data = pickle.loads(mm[start:start + section["length"]])
+                _install_index(name, _decode_section(name, data), section["sources"])
+                loaded.add(name)
+        print(f"⚡ تم تحميل {len(loaded)} فهرس من اللقطة خلال {time.time() - start_time:.2f} ثانية: {', '.join(sorted(loaded)) or '-'}", flush=True)
+    except Exception as e:
+        print(f"⚠️ تعذر تحميل لقطة الفهارس: {e}", flush=True)
+    return loaded
+
+
+# دالة بناء كل فهرس (تُستخدم في التشغيل الأول وفي إعادة التحميل التلقائي)
+INDEX_BUILDERS = {
+    "ids": lambda: load_ids_from_csv(FILES["ids"]),
+    "schedule": lambda: build_index(FILES["schedule"]),
+    "remaining": lambda: build_remaining_index(FILES["remaining"]),
+    "gpa": lambda: build_gpa_index(
+        FILES["gpa"], FILES["ids"], students=None if "ids" in _failed_indexes else INDEXES["ids"]
+    ),
+    "majors": lambda: build_majors_index(FILES["majors"]),
+    "advisor": lambda: build_advisor_index(FILES["advisor"]),
+}
 
-        INDEXES["gpa"] = {}
+INDEX_RETRY_INTERVAL = float(os.environ.get("INDEX_RETRY_INTERVAL", "60"))   # إعادة محاولة الفهارس الفاشلة (بالثواني)
 
-        print("\n📂 فهرسة IDs ...", flush=True)
-        INDEXES["ids"] = load_ids_from_csv("IDs.csv")
-        time.sleep(0.3)
+_failed_indexes = set()   # فهارس فشل بناؤها: لا تُعلَّم جاهزة ولا تُحفظ في اللقطة
 
-        print("\n📂 فهرسة MAJORS ...", flush=True)
-        INDEXES["majors"] = build_majors_index(FILES["majors"])
-        time.sleep(0.3)
+def _run_builder(name):
+    """
+    بناء فهرس واحد. النتيجة None إذا فشل البناء: البناة يرجعون None عند الخطأ صراحةً،
+    أما الفهرس الفارغ ({}) فهو نتيجة صحيحة (ملف مصدر غير موجود أو لا يحتوي أرقام متدربين).
+    """
+    try:
+        index = INDEX_BUILDERS[name]()
+    except Exception as e:
+        print(f"❌ فشل بناء فهرس {name}: {e}", flush=True)
+        import traceback; traceback.print_exc()
+        return None
+    if index is None:
+        print(f"⚠️ تعذر بناء فهرس {name}، ستُعاد المحاولة لاحقًا.", flush=True)
+    return index
+
+def _install_index(name, index, version):
+    """استبدال الفهرس مع نسخة مصادره (version: بصمة المصادر كما حُسبت قبل البناء) دفعة واحدة."""
+    if index is None:
+        _failed_indexes.add(name)
+        return False
+    with _index_swap_lock:
+        INDEXES[name] = index
+        INDEX_VERSIONS[name] = version
+    _failed_indexes.discard(name)
+    _mark_ready(name)
+    return True
+
+def initialize_indexes(ready=()):
+    """بناء الفهارس غير المحمّلة من اللقطة (ready) ثم حفظ لقطة جديدة إن تغير شيء."""
+    print("🚀 بدء تشغيل النظام وفهرسة الملفات بالخلفية...", flush=True)
+    start_time = time.time()
+    fingerprints = {name: _index_fingerprint(name) for name in INDEX_SOURCES}
+    try:
+        # IDs أولًا (سريع ويحتاجه تسجيل الدخول)، ثم بقية الملفات المستقلة بالتوازي
+        if "ids" not in ready:
+            print("\n📂 فهرسة IDs ...", flush=True)
+            _install_index("ids", _run_builder("ids"), fingerprints["ids"])
+
+        # بقية الملفات: INDEX_FILE_CONCURRENCY ملف في نفس الوقت، ويُختار التالي حسب الطلبات المنتظرة
+        pending = [name for name in INDEX_PRIORITY if name not in ready and name != "ids"]
+        running = {}
+        with ThreadPoolExecutor(max_workers=INDEX_FILE_CONCURRENCY, thread_name_prefix="index") as executor:
+            while pending or running:
+                while pending and len(running) < INDEX_FILE_CONCURRENCY:
+                    name = _next_index_to_build(pending)
+                    pending.remove(name)
+                    running[executor.submit(_run_builder, name)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name = running.pop(fut)
+                    if _install_index(name, fut.result(), fingerprints[name]):
+                        print(f"📂 فهرس {name.upper()} جاهز.", flush=True)
+
+        if set(INDEX_SOURCES) - set(ready):
+            save_snapshot(fingerprints)
 
-        INDEXES["advisor"] = None
         print("\n----------------------------", flush=True)
-        print("✅ جميع الفهارس جاهزة بنجاح.", flush=True)
+        if _failed_indexes:
+            print(f"⚠️ تعذر بناء: {', '.join(sorted(_failed_indexes))} — ستُعاد المحاولة كل {INDEX_RETRY_INTERVAL:.0f} ثانية.", flush=True)
+        else:
+            print(f"✅ جميع الفهارس جاهزة بنجاح خلال {time.time() - start_time:.1f} ثانية.", flush=True)
     except Exception as e:
         print("❌ خطأ أثناء التهيئة:", e, flush=True)
         import traceback; traceback.print_exc()
+    finally:
+        # نحرر عمليات الفهرسة بعد الانتهاء لتوفير الذاكرة
+        _shutdown_index_pool()
+
+# =========================
+# إعادة التحميل التلقائي عند تغيّر ملفات المصدر (دون إعادة تشغيل البوت)
+# =========================
+WATCH_INTERVAL = float(os.environ.get("WATCH_INTERVAL", "10"))   # بالثواني، 0 لإيقاف المراقبة
+
+_reload_lock = threading.Lock()
+
+def _stat_sources():
+    stats = {}
+    for key, path in FILES.items():
+        try:
+            st = os.stat(path)
+            stats[key] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stats[key] = None
+    return stats
+
+def reload_indexes(names):
+    """
+    إعادة بناء الفهارس المحددة فقط بالخلفية، ثم استبدال كل فهرس في INDEXES دفعة واحدة؛
+    الفهرس القديم يبقى يخدم الطلبات حتى يجهز الجديد.
+    """
+    with _reload_lock:
+        fingerprints = {name: _index_fingerprint(name) for name in INDEX_SOURCES}
+        try:
+            # IDs أولًا لأن فهرس المعدلات يعتمد عليه
+            for name in sorted(names, key=lambda n: n != "ids"):
+                print(f"🔄 إعادة بناء فهرس {name.upper()} بعد تغيّر ملف المصدر...", flush=True)
+                new_index = _run_builder(name)
+                if new_index is None:
+                    fingerprints[name] = {}
+                    # تُعاد المحاولة لاحقًا؛ الفهرس القديم (إن وُجد) يبقى لفهارس البحث، أما فهارس الصفحات
+                    # فلا تُستخدم مع الملف الجديد (_index_usable) حتى ينجح البناء
+                    _failed_indexes.add(name)
+                    if INDEXES.get(name):
+                        print(f"⚠️ تعذر بناء فهرس {name} الجديد، سيستمر استخدام الفهرس السابق حيث أمكن.", flush=True)
+                    continue
+                _install_index(name, new_index, fingerprints[name])
+                print(f"✅ تم تحديث فهرس {name.upper()} ({len(new_index)} متدرب).", flush=True)
+            save_snapshot(fingerprints)
+        except Exception as e:
+            print("❌ خطأ أثناء إعادة التحميل:", e, flush=True)
+            import traceback; traceback.print_exc()
+        finally:
+            _shutdown_index_pool()
+
+def watch_sources(baseline=None):
+    """
+    مراقبة ملفات المصدر كل WATCH_INTERVAL ثانية. لا نعيد البناء إلا بعد ثبات الملف
+    (نفس mtime والحجم في فحصين متتاليين) حتى لا نقرأ ملفًا ما زال يُرفع.
+    """
+    if WATCH_INTERVAL <= 0:
+        return
+    last = baseline or _stat_sources()
+    pending = set()
+    last_retry = time.monotonic()
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        current = _stat_sources()
+        changed = {key for key in current if current[key] != last.get(key)}
+        last = current
+        if changed:
+            pending |= changed
+            continue
+        if pending:
+            names = {name for name, sources in INDEX_SOURCES.items() if set(sources) & pending}
+            pending = set()
+            if names:
+                reload_indexes(names)
+        elif _failed_indexes and time.monotonic() - last_retry >= INDEX_RETRY_INTERVAL:
+            # إعادة محاولة الفهارس التي فشل بناؤها (خطأ مؤقت مثل نفاد الذاكرة أو تعطل مجمع العمليات)
+            last_retry = time.monotonic()
+            reload_indexes(set(_failed_indexes))
 
 # =========================
 # ضغط PDF
 # =========================
+GS_CONCURRENCY = max(1, int(os.environ.get("GS_CONCURRENCY", "2")))   # عدد عمليات Ghostscript المتزامنة
+GS_TIMEOUT = float(os.environ.get("GS_TIMEOUT", "60"))                   # مهلة كل محاولة ضغط بالثواني
+
+_gs_semaphore = asyncio.Semaphore(GS_CONCURRENCY)
+_gs_waiting = 0   # عدد طلبات الضغط المنتظرة في الطابور
+_gs_active = 0    # عدد عمليات الضغط الجارية
+
 def _gs_binary():
     # استخدم gswin64c على ويندوز، و gs على أنظمة أخرى
     return "gswin64c" if os.name == "nt" else "gs"
 
+def _gs_command(input_file, output_file, preset):
+    command = [
+        _gs_binary(), "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.4",
+        f"-dPDFSETTINGS=/{preset}", "-dNOPAUSE", "-dQUIET", "-dBATCH",
+    ]
+    if output_file == "-":
+        # الناتج على stdout: نمنع أي رسائل أخرى من الاختلاط بمحتوى الملف
+        command += ["-q", "-sstdout=%stderr"]
+    return command + [f"-sOutputFile={output_file}", input_file]
+
 def compress_pdf_with_ghostscript(input_file: str, output_file: str, max_size_mb: float = 3.0):
-    """ضغط PDF بواسطة Ghostscript مع خطة بديلة."""
+    """ضغط PDF بواسطة Ghostscript مع خطة بديلة (نسخة متزامنة للاستخدام خارج حلقة asyncio)."""
     print(f"⏳ ضغط الملف {input_file} ...", flush=True)
     try:
-        command = [
-            _gs_binary(), "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.4",
-            "-dPDFSETTINGS=/ebook", "-dNOPAUSE", "-dQUIET", "-dBATCH",
-            f"-sOutputFile={output_file}", input_file
-        ]
-        subprocess.run(command, check=True)
+        subprocess.run(_gs_command(input_file, output_file, "ebook"), check=True, timeout=GS_TIMEOUT)
         size_mb = os.path.getsize(output_file) / (1024 * 1024)
         print(f"✅ تم ضغط الملف ({size_mb:.2f} MB) باستخدام إعداد /ebook", flush=True)
         return True
     except Exception as e:
         print(f"⚠️ فشل الضغط الأول ({e})، تجربة إعداد /screen...", flush=True)
         try:
-            command = [
-                _gs_binary(), "-sDEVICE=pdfwrite", "-dCompatibilityLevel=1.4",
-                "-dPDFSETTINGS=/screen", "-dNOPAUSE", "-dQUIET", "-dBATCH",
-                f"-sOutputFile={output_file}", input_file
-            ]
-            subprocess.run(command, check=True)
+            subprocess.run(_gs_command(input_file, output_file, "screen"), check=True, timeout=GS_TIMEOUT)
             size_mb = os.path.getsize(output_file) / (1024 * 1024)
             print(f"✅ تم ضغط الملف ({size_mb:.2f} MB) باستخدام إعداد /screen", flush=True)
             return True
@@ -349,6 +1183,576 @@ def compress_pdf_with_ghostscript(input_file: str, output_file: str, max_size_mb
             print(f"❌ فشل الضغط تمامًا ({e2})، سيتم استخدام النسخة الأصلية.", flush=True)
             return False
 
+async def _run_ghostscript(data, preset):
+    """تمرير PDF إلى Ghostscript عبر stdin واستلام الملف المضغوط من stdout (دون ملفات مؤقتة من طرفنا)."""
+    proc = await asyncio.create_subprocess_exec(
+        *_gs_command("-", "-", preset),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(data), timeout=GS_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise RuntimeError(f"gs exit {proc.returncode}: {stderr.decode(errors='ignore').strip()[:200]}")
+    if not stdout.startswith(b"%PDF"):
+        raise RuntimeError("gs output is not a PDF")
+    return stdout
+
+async def compress_pdf_async(data: bytes):
+    """
+    ضغط PDF في الذاكرة دون حجب حلقة asyncio: عملية Ghostscript غير متزامنة مع مهلة،
+    وعدد العمليات المتزامنة محدود بـ GS_CONCURRENCY والباقي ينتظر في الطابور.
+    النتيجة: محتوى الملف المضغوط، أو None عند الفشل.
+    """
+    global _gs_waiting, _gs_active
+    _gs_waiting += 1
+    if _gs_semaphore.locked():
+        print(f"⏳ طلب ضغط في الطابور (المنتظرون: {_gs_waiting})", flush=True)
+    try:
+        await _gs_semaphore.acquire()
+    finally:
+        _gs_waiting -= 1
+
+    _gs_active += 1
+    try:
+        print(f"⏳ ضغط ملف ({len(data) / (1024 * 1024):.2f} MB) ...", flush=True)
+        try:
+            compressed = await _run_ghostscript(data, "ebook")
+            print(f"✅ تم ضغط الملف ({len(compressed) / (1024 * 1024):.2f} MB) باستخدام إعداد /ebook", flush=True)
+            return compressed
+        except asyncio.TimeoutError:
+            # لا فائدة من المحاولة الثانية إن تجاوزت الأولى المهلة
+            print(f"❌ تجاوز الضغط المهلة ({GS_TIMEOUT:.0f} ثانية)، سيتم استخدام النسخة الأصلية.", flush=True)
+            return None
+        except Exception as e:
+            print(f"⚠️ فشل الضغط الأول ({e})، تجربة إعداد /screen...", flush=True)
+
+        try:
+            compressed = await _run_ghostscript(data, "screen")
+            print(f"✅ تم ضغط الملف ({len(compressed) / (1024 * 1024):.2f} MB) باستخدام إعداد /screen", flush=True)
+            return compressed
+        except asyncio.TimeoutError:
+            print(f"❌ تجاوز الضغط المهلة ({GS_TIMEOUT:.0f} ثانية)، سيتم استخدام النسخة الأصلية.", flush=True)
+            return None
+        except Exception as e2:
+            print(f"❌ فشل الضغط تمامًا ({e2})، سيتم استخدام النسخة الأصلية.", flush=True)
+            return None
+    finally:
+        _gs_active -= 1
+        _gs_semaphore.release()
+
+# =========================
+# مجمع قرّاء PDF مشترك لكل ملف مصدر (بدل تحليل الملف كاملًا مع كل طلب)
+# =========================
+READER_POOL_SIZE = max(1, int(os.environ.get("READER_POOL_SIZE", "2")))   # قرّاء لكل ملف (طلب واحد لكل قارئ)
+# ربط الملف بالذاكرة (mmap) بدل نسخه؛ معطّل افتراضيًا لأن استبدال الملف بالكتابة فوقه أثناء الربط قد يُسقط العملية
+PDF_MMAP = os.environ.get("PDF_MMAP", "0") == "1"
+
+_reader_pools = {}   # المسار -> {"version", "free": [قرّاء جاهزة], "created"}
+_reader_pools_lock = threading.Lock()
+# المنتظرون لقارئ يُوقظون عند إعادة أي قارئ أو استبدال مجمع (فمن ينتظر مجمعًا قديمًا يعيد المحاولة بالمجمع الجديد)
+_reader_pools_cond = threading.Condition(_reader_pools_lock)
+
+def _open_reader(pdf_path):
+    from PyPDF2 import PdfReader
+    if PDF_MMAP:
+        with open(pdf_path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return PdfReader(mm)
+    return PdfReader(pdf_path)
+
+def _close_reader(reader):
+    stream = getattr(reader, "stream", None)
+    if isinstance(stream, mmap.mmap):
+        try:
+            stream.close()
+        except Exception:
+            pass
+
+class SourceChanged(Exception):
+    """ملف المصدر لم يعد بالنسخة التي بُني منها الفهرس (استُبدل ولم يُعد فهرسته بعد)."""
+
+
+def _acquire_reader_slot(pdf_path, version):
+    """
+    حجز قارئ من مجمع نسخة الملف المطلوبة: (المجمع، قارئ جاهز أو None إن كان علينا إنشاؤه).
+    إن لم يعد الملف بهذه النسخة نرفع SourceChanged بدل قراءة صفحات من ملف مختلف.
+    إذا استُبدل المجمع أثناء الانتظار نعيد الفحص ونبدأ من جديد بدل الانتظار على مجمع لن يعود إليه أحد.
+    """
+    while True:
+        if _source_version(pdf_path) != version:
+            raise SourceChanged(pdf_path)
+        with _reader_pools_cond:
+            pool = _reader_pools.get(pdf_path)
+            if pool is None or pool["version"] != version:
+                if pool is not None:
+                    for reader in pool["free"]:
+                        _close_reader(reader)
+                    pool["free"].clear()
+                pool = {"version": version, "free": [], "created": 0}
+                _reader_pools[pdf_path] = pool
+                _reader_pools_cond.notify_all()
+
+            while _reader_pools.get(pdf_path) is pool:
+                if pool["free"]:
+                    return pool, pool["free"].pop()
+                if pool["created"] < READER_POOL_SIZE:
+                    pool["created"] += 1
+                    return pool, None
+                _reader_pools_cond.wait()
+
+@contextmanager
+def _borrow_reader(pdf_path, version):
+    """
+    استعارة قارئ جاهز (سبق تحليل جدول xref وشجرة الصفحات فيه) من مجمع الملف بالنسخة version.
+    كل قارئ يستخدمه خيط واحد في كل مرة؛ والمجمع يُستبدل عند تغيّر نسخة الملف.
+    """
+    pool, reader = _acquire_reader_slot(pdf_path, version)
+    if reader is None:
+        try:
+            reader = _open_reader(pdf_path)
+        except Exception:
+            with _reader_pools_cond:
+                pool["created"] -= 1
+                _reader_pools_cond.notify_all()
+            raise
+
+    try:
+        yield reader
+    finally:
+        with _reader_pools_cond:
+            current = _reader_pools.get(pdf_path) is pool
+            if current:
+                pool["free"].append(reader)
+                _reader_pools_cond.notify_all()
+        if not current:
+            _close_reader(reader)
+
+# =========================
+# كاش ملفات المتدربين الجاهزة (ذاكرة + قرص)
+# =========================
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", "pdf_cache")
+PDF_CACHE_MAX_MB = float(os.environ.get("PDF_CACHE_MAX_MB", "200"))
+PDF_MEMORY_CACHE_MAX_MB = float(os.environ.get("PDF_MEMORY_CACHE_MAX_MB", "32"))
+
+_pdf_memory_cache = OrderedDict()   # المفتاح -> محتوى الملف (الأحدث استخدامًا في النهاية)
+_pdf_memory_bytes = 0
+_pdf_cache_lock = threading.Lock()
+
+PDF_CACHE_EVICT_EVERY = max(1, int(os.environ.get("PDF_CACHE_EVICT_EVERY", "50")))   # تنظيف القرص كل N كتابة
+_disk_cache_bytes = None          # تقدير حجم كاش القرص (None = غير معروف حتى أول تنظيف)
+_disk_writes_since_evict = 0
+_evict_lock = threading.Lock()
+
+def _pdf_cache_key(service, student_id, version):
+    """version: نسخة ملف المصدر التي بُني منها الفهرس (لا نسخة الملف الحالية) فيطابق المفتاح الصفحات المقتطعة."""
+    return f"{service}_{student_id}_{version}"
+
+def _pdf_memory_put(key, data):
+    global _pdf_memory_bytes
+    limit = PDF_MEMORY_CACHE_MAX_MB * 1024 * 1024
+    if len(data) > limit:
+        return
+    with _pdf_cache_lock:
+        old = _pdf_memory_cache.pop(key, None)
+        if old is not None:
+            _pdf_memory_bytes -= len(old)
+        _pdf_memory_cache[key] = data
+        _pdf_memory_bytes += len(data)
+        while _pdf_memory_bytes > limit:
+            _, evicted = _pdf_memory_cache.popitem(last=False)
+            _pdf_memory_bytes -= len(evicted)
+
+def _evict_disk_cache():
+    """
+    حذف النسخ المبنية من نسخ سابقة لنفس الملف، ثم الأقدم استخدامًا (حسب mtime) حتى يعود حجم مجلد الكاش تحت الحد.
+    تعمل في خيط خلفي، ولا يُنفَّذ أكثر من تنظيف واحد في نفس الوقت.
+    """
+    global _disk_cache_bytes, _disk_writes_since_evict
+    if not _evict_lock.acquire(blocking=False):
+        return
+    try:
+        limit = PDF_CACHE_MAX_MB * 1024 * 1024
+        latest = {}   # الملف دون النسخة -> أحدث نسخة مكتوبة
+        entries = []
+        for entry in os.scandir(PDF_CACHE_DIR):
+            if entry.is_file() and entry.name.endswith(".pdf"):
+                st = entry.stat()
+                item = (st.st_mtime, st.st_size, entry.path)
+                doc = entry.name[:-4].rsplit("_", 1)[0]
+                previous = latest.get(doc)
+                if previous is None or item > previous:
+                    if previous is not None:
+                        entries.append(previous + (True,))
+                    latest[doc] = item
+                else:
+                    entries.append(item + (True,))
+        entries.extend(item + (False,) for item in latest.values())
+
+        total = 0
+        for mtime, size, path, stale in sorted(entries):
+            if stale:
+                os.remove(path)
+            else:
+                total += size
+        for mtime, size, path, stale in sorted(entries):
+            if total <= limit:
+                break
+            if not stale:
+                os.remove(path)
+                total -= size
+        with _pdf_cache_lock:
+            _disk_cache_bytes = total
+            _disk_writes_since_evict = 0
+    except Exception as e:
+        print(f"⚠️ تعذر تنظيف كاش الملفات: {e}", flush=True)
+    finally:
+        _evict_lock.release()
+
+def _pdf_memory_get(key):
+    with _pdf_cache_lock:
+        data = _pdf_memory_cache.get(key)
+        if data is not None:
+            _pdf_memory_cache.move_to_end(key)
+    count_cache("memory", data is not None)
+    return data
+
+def _pdf_disk_get(key):
+    """قراءة الملف من كاش القرص (تُستدعى عبر asyncio.to_thread) ونقله إلى كاش الذاكرة."""
+    path = os.path.join(PDF_CACHE_DIR, key + ".pdf")
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)   # تحديث ترتيب LRU على القرص
+    except FileNotFoundError:
+        count_cache("disk", False)
+        return None
+    except Exception as e:
+        print(f"⚠️ تعذر قراءة الكاش {path}: {e}", flush=True)
+        return None
+    count_cache("disk", True)
+    _pdf_memory_put(key, data)
+    return data
+
+def _pdf_memory_has(key):
+    """فحص وجود الملف في كاش الذاكرة دون قراءته (ودون احتسابه في معدلات الإصابة)."""
+    with _pdf_cache_lock:
+        return key in _pdf_memory_cache
+
+def _pdf_disk_put(key, data):
+    """كتابة الملف في كاش القرص (في خيط خلفي)، والتنظيف فقط كل PDF_CACHE_EVICT_EVERY كتابة أو عند تجاوز الحد."""
+    global _disk_cache_bytes, _disk_writes_since_evict
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        path = os.path.join(PDF_CACHE_DIR, key + ".pdf")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"⚠️ تعذر حفظ الملف في الكاش: {e}", flush=True)
+        return
+    with _pdf_cache_lock:
+        _disk_cache_bytes = None if _disk_cache_bytes is None else _disk_cache_bytes + len(data)
+        _disk_writes_since_evict += 1
+        due = (
+            _disk_cache_bytes is None
+            or _disk_cache_bytes > PDF_CACHE_MAX_MB * 1024 * 1024
+            or _disk_writes_since_evict >= PDF_CACHE_EVICT_EVERY
+        )
+    if due:
+        _evict_disk_cache()
+
+def _pdf_cache_put(key, data):
+    """حفظ في كاش الذاكرة فورًا، والكتابة على القرص في الخلفية دون تأخير الرد."""
+    _pdf_memory_put(key, data)
+    threading.Thread(target=_pdf_disk_put, args=(key, data), daemon=True, name="pdf-cache").start()
+
+# =========================
+# التجهيز المسبق لملفات كل المتدربين (python Bot.py --presplit)
+# =========================
+PRESPLIT_DIR = os.environ.get("PRESPLIT_DIR", "presplit")
+PRESPLIT_SERVICES = ("schedule", "remaining")
+PRESPLIT_CHUNK = 50   # عدد المتدربين في كل مهمة للعمليات الفرعية
+
+_presplit_manifest = None   # (mtime ملف الفهرس، محتواه)
+_presplit_lock = threading.Lock()
+
+def _presplit_manifest_path():
+    return os.path.join(PRESPLIT_DIR, "manifest.json")
+
+def _presplit_object_path(digest):
+    return os.path.join(PRESPLIT_DIR, "objects", digest + ".pdf")
+
+def _presplit_chunk(pdf_path, items):
+    """
+    تُنفَّذ داخل عملية فرعية: استخراج وضغط ملفات مجموعة من المتدربين وحفظها باسم بصمة محتواها.
+    items: [(رقم المتدرب، الصفحات)] — النتيجة: [(رقم المتدرب، البصمة)].
+    """
+    from PyPDF2 import PdfReader, PdfWriter
+    os.makedirs(os.path.join(PRESPLIT_DIR, "objects"), exist_ok=True)
+    reader = PdfReader(pdf_path)
+    results = []
+    for sid, pages in items:
+        fd, raw_path = tempfile.mkstemp(suffix=".pdf", dir=PRESPLIT_DIR)
+        os.close(fd)
+        compressed_path = raw_path[:-4] + "_c.pdf"
+        try:
+            writer = PdfWriter()
+            for i in pages:
+                if i < len(reader.pages):
+                    writer.add_page(reader.pages[i])
+            with open(raw_path, "wb") as f:
+                writer.write(f)
+
+            final_path = compressed_path if compress_pdf_with_ghostscript(raw_path, compressed_path) else raw_path
+            with open(final_path, "rb") as f:
+                data = f.read()
+
+            digest = hashlib.sha256(data).hexdigest()
+            object_path = _presplit_object_path(digest)
+            if not os.path.exists(object_path):
+                os.replace(final_path, object_path)
+            results.append((sid, digest))
+        except Exception as e:
+            print(f"❌ تعذر تجهيز ملف المتدرب {sid}: {e}", flush=True)
+        finally:
+            for path in (raw_path, compressed_path):
+                if os.path.exists(path):
+                    os.remove(path)
+    return results
+
+def presplit_all():
+    """
+    وضع دفعي: بناء الفهارس ثم تجهيز وضغط ملف كل متدرب (الجدول والمقررات المتبقية) مسبقًا وبالتوازي،
+    ليصبح الرد وقت الطلب مجرد قراءة ملف جاهز.
+    """
+    print("🚀 التجهيز المسبق لملفات المتدربين...", flush=True)
+    start_time = time.time()
+    os.makedirs(os.path.join(PRESPLIT_DIR, "objects"), exist_ok=True)
+    manifest = {}
+    try:
+        for service in PRESPLIT_SERVICES:
+            pdf_path = FILES[service]
+            if not os.path.exists(pdf_path):
+                print(f"⚠️ الملف {pdf_path} غير موجود، تم تخطيه.", flush=True)
+                continue
+
+            version = _source_version(pdf_path)   # قبل الفهرسة: إن تغيّر الملف أثناءها لن تطابق النسخة ولن تُستخدم
+            index = build_index(pdf_path) if service == "schedule" else build_remaining_index(pdf_path)
+            if index is None:
+                print(f"⚠️ تعذر فهرسة {pdf_path}، تم تخطيه.", flush=True)
+                continue
+            if service == "schedule":
+                items = [(sid, list(range(s, e))) for sid, (s, e) in index.items()]
+            else:
+                items = list(index.items())
+
+            chunks = [items[i:i + PRESPLIT_CHUNK] for i in range(0, len(items), PRESPLIT_CHUNK)]
+            students = {}
+            pool = _get_index_pool()
+            futures = [pool.submit(_presplit_chunk, pdf_path, chunk) for chunk in chunks]
+            for fut in as_completed(futures):
+                students.update(fut.result())
+                print(f"📦 {service}: {len(students)}/{len(items)} متدرب", flush=True)
+
+            manifest[service] = {"source_version": version, "students": students}
+
+        tmp_path = _presplit_manifest_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, _presplit_manifest_path())
+
+        # حذف الملفات التي لم تعد مستخدمة في الفهرس الجديد
+        used = {d for entry in manifest.values() for d in entry["students"].values()}
+        objects_dir = os.path.join(PRESPLIT_DIR, "objects")
+        for name in os.listdir(objects_dir):
+            if name.endswith(".pdf") and name[:-4] not in used:
+                os.remove(os.path.join(objects_dir, name))
+
+        total = sum(len(entry["students"]) for entry in manifest.values())
+        print(f"✅ تم تجهيز {total} ملف مسبقًا خلال {time.time() - start_time:.1f} ثانية.", flush=True)
+    finally:
+        _shutdown_index_pool()
+
+def _presplit_get(service, student_id, version):
+    """قراءة ملف المتدرب المجهز مسبقًا إن كان مبنيًا من نسخة الملف المصدر version (نسخة الفهرس)، وإلا None."""
+    global _presplit_manifest
+    manifest_path = _presplit_manifest_path()
+    try:
+        mtime = os.path.getmtime(manifest_path)
+    except OSError:
+        return None
+
+    with _presplit_lock:
+        if _presplit_manifest is None or _presplit_manifest[0] != mtime:
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    _presplit_manifest = (mtime, json.load(f))
+            except Exception as e:
+                print(f"⚠️ تعذر قراءة فهرس الملفات الجاهزة: {e}", flush=True)
+                return None
+        entry = _presplit_manifest[1].get(service)
+
+    if not entry or entry.get("source_version") != version:
+        return None
+    digest = entry["students"].get(student_id)
+    if not digest:
+        return None
+    try:
+        with open(_presplit_object_path(digest), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+# =========================
+# سجل file_id لتيليجرام (إعادة إرسال الملفات دون رفعها من جديد)
+# =========================
+FILE_ID_REGISTRY_PATH = os.environ.get("FILE_ID_REGISTRY", "file_ids.sqlite3")
+LEGACY_FILE_ID_REGISTRY = "file_ids.json"   # الصيغة السابقة، تُستورد مرة واحدة إن وُجدت
+FILE_ID_FLUSH_DELAY = float(os.environ.get("FILE_ID_FLUSH_DELAY", "2"))   # تجميع الكتابات في دفعة واحدة
+
+_file_ids = None        # المفتاح (الملف + نسخته) -> file_id
+_file_id_docs = {}      # الملف دون النسخة -> مفتاح النسخة المسجلة (لحذف النسخة السابقة دون المرور على السجل كله)
+_file_id_pending = {}   # تغييرات لم تُكتب بعد: المفتاح -> file_id أو None للحذف
+_file_id_timer = None
+_file_ids_lock = threading.Lock()
+_file_id_db_lock = threading.Lock()
+_file_id_db = None
+
+def _file_id_doc(key):
+    return key.rsplit("_", 1)[0]
+
+def _file_id_conn():
+    # يُستدعى مع قفل القاعدة
+    global _file_id_db
+    if _file_id_db is None:
+        _file_id_db = sqlite3.connect(FILE_ID_REGISTRY_PATH, check_same_thread=False, isolation_level=None)
+        _file_id_db.execute("PRAGMA journal_mode=WAL")
+        _file_id_db.execute("PRAGMA synchronous=NORMAL")
+        _file_id_db.execute("CREATE TABLE IF NOT EXISTS file_ids (key TEXT PRIMARY KEY, file_id TEXT NOT NULL)")
+    return _file_id_db
+
+def _file_ids_map():
+    # يُستدعى مع قفل السجل؛ التحميل مرة واحدة عند أول استخدام
+    global _file_ids
+    if _file_ids is None:
+        _file_ids = {}
+        try:
+            with _file_id_db_lock:
+                conn = _file_id_conn()
+                rows = conn.execute("SELECT key, file_id FROM file_ids").fetchall()
+                if not rows and os.path.exists(LEGACY_FILE_ID_REGISTRY):
+                    with open(LEGACY_FILE_ID_REGISTRY, "r", encoding="utf-8") as f:
+                        rows = list(json.load(f).items())
+                    conn.execute("BEGIN")
+                    conn.executemany("INSERT OR REPLACE INTO file_ids (key, file_id) VALUES (?, ?)", rows)
+                    conn.execute("COMMIT")
+                    print(f"📦 تم نقل {len(rows)} file_id من {LEGACY_FILE_ID_REGISTRY}", flush=True)
+            for key, file_id in rows:
+                doc = _file_id_doc(key)
+                old = _file_id_docs.get(doc)
+                if old is not None and old != key:
+                    _file_id_pending[old] = None   # بقايا نسخة سابقة
+                    _file_ids.pop(old, None)
+                _file_ids[key] = file_id
+                _file_id_docs[doc] = key
+        except Exception as e:
+            print(f"⚠️ تعذر قراءة سجل file_id: {e}", flush=True)
+    return _file_ids
+
+def flush_file_ids():
+    """كتابة التغييرات المتراكمة في معاملة واحدة (تعمل في خيط المؤقت، لا في حلقة asyncio)."""
+    global _file_id_timer
+    with _file_ids_lock:
+        batch = dict(_file_id_pending)
+        _file_id_pending.clear()
+        _file_id_timer = None
+    if not batch:
+        return
+    try:
+        with _file_id_db_lock:
+            conn = _file_id_conn()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO file_ids (key, file_id) VALUES (?, ?)",
+                    [(k, v) for k, v in batch.items() if v],
+                )
+                conn.executemany("DELETE FROM file_ids WHERE key = ?", [(k,) for k, v in batch.items() if not v])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    except Exception as e:
+        print(f"⚠️ تعذر حفظ سجل file_id: {e}", flush=True)
+        with _file_ids_lock:
+            for k, v in batch.items():
+                _file_id_pending.setdefault(k, v)
+
+def _get_file_id(key):
+    with _file_ids_lock:
+        return _file_ids_map().get(key)
+
+def _set_file_id(key, file_id):
+    global _file_id_timer
+    with _file_ids_lock:
+        ids = _file_ids_map()
+        doc = _file_id_doc(key)
+        if file_id:
+            # نسخة جديدة من الملف تلغي file_id الخاص بالنسخة السابقة
+            old = _file_id_docs.get(doc)
+            if old is not None and old != key:
+                ids.pop(old, None)
+                _file_id_pending[old] = None
+            ids[key] = file_id
+            _file_id_docs[doc] = key
+        else:
+            ids.pop(key, None)
+            if _file_id_docs.get(doc) == key:
+                del _file_id_docs[doc]
+        _file_id_pending[key] = file_id
+        if _file_id_timer is None:
+            _file_id_timer = threading.Timer(FILE_ID_FLUSH_DELAY, flush_file_ids)
+            _file_id_timer.daemon = True
+            _file_id_timer.start()
+
+async def _reply_document_cached(message, key, load_document, filename, caption, service="document"):
+    """
+    إرسال مستند عبر file_id إن سبق رفعه بنفس النسخة، وإلا رفعه وحفظ file_id الناتج.
+    load_document: دالة async تُرجع محتوى الملف، لا تُستدعى إلا عند الحاجة للرفع.
+    """
+    file_id = _get_file_id(key)
+    count_cache("file_id", bool(file_id))
+    if file_id:
+        try:
+            with timed(service, "upload"):
+                return await message.reply_document(file_id, caption=caption)
+        except BadRequest as e:
+            print(f"⚠️ file_id غير صالح ({e})، سيتم رفع الملف من جديد.", flush=True)
+            _set_file_id(key, None)
+
+    data = await load_document()
+    # طلب مماثل انتهى من الرفع أثناء انتظارنا؟ نعيد استخدام file_id بدل رفع نفس الملف مرة أخرى
+    file_id = _get_file_id(key)
+    if file_id:
+        try:
+            with timed(service, "upload"):
+                return await message.reply_document(file_id, caption=caption)
+        except BadRequest:
+            _set_file_id(key, None)
+    with timed(service, "upload"):
+        sent = await message.reply_document(data, filename=filename, caption=caption)
+    document = getattr(sent, "document", None)
+    if document and document.file_id:
+        _set_file_id(key, document.file_id)
+    return sent
+
 # =========================
 # الخدمات
 # =========================
@@ -357,70 +1761,45 @@ async def send_advisor(update, context, student_id):
     if not os.path.exists(csv_path):
         await update.message.reply_text("❌ ملف المرشد غير متاح حالياً.")
         return
-    sent_msg = await update.message.reply_text("👨‍🏫 جاري البحث عن مرشدك التدريبي...")
-    try:
-        df = pd.read_csv(csv_path, encoding='utf-8', dtype=str)
-    except Exception as e:
-        await sent_msg.delete()
-        await update.message.reply_text(f"❌ خطأ في قراءة ملف المرشدين: {e}")
-        return
 
-    advisor_name = None
-    mask = df.apply(lambda row: row.astype(str).str.contains(student_id, regex=False, na=False).any(), axis=1)
-    matched_rows = df[mask]
-    if not matched_rows.empty:
-        for _, row in matched_rows.iterrows():
-            text = " ".join(row.dropna().astype(str))
-            match = re.search(r"00\d{5,7}\s*([^\d\n\r]+)", text)
-            if match:
-                advisor_name = match.group(1).strip()
-                advisor_name = re.sub(r"مرشد أكاديمي", "", advisor_name)
-                advisor_name = advisor_name.replace(",", "").replace('"', "").strip()
-                break
-    await sent_msg.delete()
+    # نعتمد على فهرس المرشدين المبني عند التشغيل (بحث مباشر O(1))
+    with timed("advisor", "lookup"):
+        rec = (INDEXES.get("advisor") or {}).get(student_id)
+        advisor_name = rec.get("advisor_name") if rec else None
     if advisor_name:
         await update.message.reply_text(f"👨‍🏫 مرشدك التدريبي هو:\nأ. {advisor_name}")
     else:
         await update.message.reply_text("⚠️ لم يتم العثور على اسم المرشد.")
 
 async def send_gpa(update, context, student_id):
-    pdf_path = FILES.get("gpa")
-    if not os.path.exists(pdf_path):
+    # نعتمد على فهرس المعدلات المبني عند التشغيل، دون فتح GPA.pdf وقت الطلب
+    with timed("gpa", "lookup"):
+        gpa_value = (INDEXES.get("gpa") or {}).get(student_id)
+    if not gpa_value and not any(os.path.exists(p) for p in (FILES["gpa"], FILES["ids"])):
         await update.message.reply_text("❌ ملف المعدل غير متاح حالياً.")
         return
-    sent_msg = await update.message.reply_text("🎓 جاري البحث عن معدلك...")
-    gpa_value = None
-    try:
-        reader = PdfReader(pdf_path)
-        for page in reader.pages:
-            text = page.extract_text() or ""
-            for line in text.splitlines():
-                if student_id in line:
-                    match = re.search(r"\b\d\.\d{2}\b", line)
-                    if match:
-                        gpa_value = match.group(0)
-                        break
-            if gpa_value:
-                break
-    except Exception as e:
-        await sent_msg.delete()
-        await update.message.reply_text(f"❌ خطأ في قراءة ملف المعدل: {e}")
-        return
 
-    await sent_msg.delete()
     if gpa_value:
         await update.message.reply_text(f"🎓 معدلك هو: {gpa_value}")
     else:
         await update.message.reply_text("⚠️ لم يتم العثور على المعدل.")
 
-# خرائط العبارات إلى ملفات الخطط + كابتشنات
-MAJOR_PHRASES_TO_PLAN = {
-    "قيرتتلارصاتتللانلتتلااييرت": "VocationalSafetyAndHealth.pdf",
-    "لااا لقللتلا رارهترا": "LabsPlan.pdf",
-    "قعرلتلااصلقمتلالرقرل": "HRplan.pdf",
-    "قحرتتفاارتتلالرقت": "EPplan.pdf",
-    "قلرتترغاتتلةمارت": "FoodSafetyPlan.pdf",
+# البرنامج في IDs.csv -> ملف الخطة (احتياطي لمن لا يظهر في فهرس التخصصات)
+PROGRAM_KEYWORDS_TO_PLAN = {
+    "الموارد البشرية": "HRplan.pdf",
+    "السلامة والصحة": "VocationalSafetyAndHealth.pdf",
+    "حماية البيئة": "EPplan.pdf",
+    "سلامة الاغذية": "FoodSafetyPlan.pdf",
+    "المختبرات الكيميائ": "LabsPlan.pdf",
 }
+
+def _plan_for_program(program: str) -> str:
+    for keyword, plan_file in PROGRAM_KEYWORDS_TO_PLAN.items():
+        if keyword in (program or ""):
+            return plan_file
+    return ""
+
+# كابتشنات ملفات الخطط
 PLAN_CAPTIONS = {
     "HRplan.pdf": "💼 الخطة التفصيلية لتخصص الموارد البشرية",
     "EPplan.pdf": "🌿 الخطة التفصيلية لتخصص حماية البيئة",
@@ -429,51 +1808,280 @@ PLAN_CAPTIONS = {
     "VocationalSafetyAndHealth.pdf": "🦺 الخطة التفصيلية لتخصص السلامة والصحة المهنية",
 }
 
-def _normalize_spaces(s: str) -> str:
-    return " ".join((s or "").split())
-
 async def send_detailed_plan(update, context, student_id):
-    # نعتمد على majors_index.json المبني مسبقًا
-    index_path = "majors_index.json"
-    if not os.path.exists(index_path):
+    # نعتمد على فهرس التخصصات المحمّل في الذاكرة (رقم المتدرب -> ملف الخطة)
+    majors_index = INDEXES.get("majors") or {}
+    students = INDEXES.get("ids") or {}
+    if not majors_index and not students:
         await update.message.reply_text("⚠️ فهرس التخصصات غير جاهز بعد. حاول لاحقًا.")
         return
 
-    try:
-        with open(index_path, "r", encoding="utf-8") as f:
-            majors_index = json.load(f)
-    except Exception as e:
-        await update.message.reply_text(f"❌ خطأ في قراءة فهرس التخصصات: {e}")
-        return
-
-    if student_id not in majors_index:
+    if student_id not in majors_index and student_id not in students:
         await update.message.reply_text("⚠️ لم يتم العثور على بيانات المتدرب في فهرس التخصصات.")
         return
 
-    text = _normalize_spaces(majors_index[student_id])
-    plan_file_to_send = None
-    for phrase, plan_file in MAJOR_PHRASES_TO_PLAN.items():
-        if _normalize_spaces(phrase) in text and os.path.exists(plan_file):
-            plan_file_to_send = plan_file
-            break
-
-    if not plan_file_to_send:
+    with timed("detailed_plan", "lookup"):
+        plan_file_to_send = majors_index.get(student_id)
+        if not plan_file_to_send and student_id in students:
+            # احتياطي: البرنامج المسجل للمتدرب في IDs.csv
+            plan_file_to_send = _plan_for_program(students[student_id].program)
+    if not plan_file_to_send or not os.path.exists(plan_file_to_send):
         await update.message.reply_text("⚠️ لم يتم العثور على التخصص المناسب.")
         return
 
     caption = PLAN_CAPTIONS.get(plan_file_to_send, "📑 خطتك التفصيلية")
-    try:
+
+    async def load_document():
         with open(plan_file_to_send, "rb") as f:
-            await update.message.reply_document(f, filename=os.path.basename(plan_file_to_send), caption=caption)
+            return f.read()
+
+    try:
+        key = f"{plan_file_to_send}_{_source_version(plan_file_to_send)}"
+        await _reply_document_cached(
+            update.message, key, load_document,
+            filename=os.path.basename(plan_file_to_send), caption=caption,
+            service="detailed_plan",
+        )
     except Exception as e:
         await update.message.reply_text(f"❌ تعذر إرسال الملف: {e}")
 
+def _render_student_pages(pdf_path, pages, version):
+    """نسخ صفحات المتدرب إلى PDF جديد في الذاكرة، من الملف المصدر بالنسخة version فقط."""
+    from PyPDF2 import PdfWriter
+    buffer = io.BytesIO()
+    # القارئ محجوز حتى انتهاء الكتابة لأن PdfWriter يقرأ الكائنات من ملف المصدر أثناء write
+    with _borrow_reader(pdf_path, version) as reader:
+        writer = PdfWriter()
+        for i in pages:
+            if i < len(reader.pages):
+                writer.add_page(reader.pages[i])
+        writer.write(buffer)
+    # الملف استُبدل أثناء القراءة؟ لا نحفظ ناتجًا قد يخلط النسختين
+    if _source_version(pdf_path) != version:
+        raise SourceChanged(pdf_path)
+    return buffer.getvalue()
+
+async def build_student_pdf(service, student_id, pdf_path, pages, version):
+    """استخراج صفحات المتدرب من الملف المصدر وضغطها في الذاكرة، وإرجاع محتوى الملف النهائي."""
+    # العمل على PDF وضغطه خارج حلقة asyncio حتى لا يتوقف البوت لبقية المستخدمين
+    with timed(service, "assembly"):
+        data = await asyncio.to_thread(_render_student_pages, pdf_path, pages, version)
+
+    # 📦 ضغط الملف قبل الإرسال، وعند الفشل نرسل النسخة الأصلية
+    with timed(service, "compression"):
+        compressed = await compress_pdf_async(data)
+    if compressed is None:
+        print("⚠️ فشل الضغط، سيتم إرسال النسخة الأصلية.", flush=True)
+        return data
+    return compressed
+
+# الخدمة -> الفهرس الذي تحتاجه
+SERVICE_INDEX = {
+    "schedule": "schedule",
+    "remaining": "remaining",
+    "advisor": "advisor",
+    "gpa": "gpa",
+    "detailed_plan": "majors",
+}
+
+async def _ensure_index_ready(update, name):
+    if name not in INDEX_READY or _index_usable(name):
+        return True
+    waiting_msg = await update.message.reply_text("⏳ جاري تجهيز البيانات بعد تحديث النظام، لحظات...")
+    ready = await wait_for_index(name)
+    await waiting_msg.delete()
+    if not ready:
+        await update.message.reply_text("⚠️ البيانات ما زالت قيد التجهيز، حاول مرة أخرى بعد قليل.")
+    return ready
+
+def _student_pages(service, student_id):
+    """
+    (صفحات المتدرب في ملف الخدمة حسب الفهرس، نسخة ملف المصدر التي بُني منها هذا الفهرس).
+    الصفحات None أو قائمة فارغة إن لم يوجد المتدرب؛ والنسخة تُقرأ مع الفهرس نفسه فلا يختلطان أثناء الاستبدال.
+    """
+    with _index_swap_lock:
+        index = INDEXES.get(service) or {}
+        version = (INDEX_VERSIONS.get(service) or {}).get(FILES.get(service))
+    if service == "remaining":
+        return index.get(student_id, []), version
+    if student_id in index:
+        # مدى صفحات المتدرب محسوب مسبقًا وقت الفهرسة
+        start, end = index[student_id]
+        return range(start, end), version
+    return None, version
+
+async def _prepare_student_pdf(service, student_id, pdf_path, pages, version, cache_key):
+    """محتوى ملف المتدرب النهائي: من الكاش، أو من ملفات --presplit، أو بناؤه وحفظه في الكاش."""
+    # ♻️ الملف النهائي المضغوط محفوظ مسبقًا لنفس نسخة الملف المصدر؟ (القرص يُقرأ خارج حلقة asyncio)
+    data = _pdf_memory_get(cache_key)
+    if data is None:
+        data = await asyncio.to_thread(_pdf_disk_get, cache_key)
+    if data is None:
+        # 📦 ملف مجهز مسبقًا بوضع --presplit؟
+        data = await asyncio.to_thread(_presplit_get, service, student_id, version)
+        count_cache("presplit", data is not None)
+        if data is not None:
+            _pdf_memory_put(cache_key, data)
+            return data
+        data = await build_student_pdf(service, student_id, pdf_path, pages, version)
+        _pdf_cache_put(cache_key, data)
+    return data
+
+# =========================
+# دمج الطلبات المتطابقة الجارية + الحد من النقرات المتكررة
+# =========================
+TAP_THROTTLE_SECONDS = float(os.environ.get("TAP_THROTTLE_SECONDS", "3"))   # تجاهل تكرار نفس الزر خلال هذه المدة
+THROTTLED_SERVICES = {"schedule", "remaining"}   # الخدمات الثقيلة فقط (استخراج وضغط PDF)
+
+_inflight = {}        # المفتاح -> المهمة المشتركة الجارية
+_user_active = set()  # (المستخدم، الخدمة) قيد التنفيذ
+_user_last_done = {}  # (المستخدم، الخدمة) -> وقت آخر اكتمال
+
+async def single_flight(key, factory):
+    """
+    تنفيذ factory مرة واحدة لكل مفتاح: الطلبات المتزامنة بنفس المفتاح تنتظر نفس النتيجة.
+    المهمة المشتركة محمية بـ shield فإلغاء أحد المنتظرين لا يلغيها على البقية.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+
+        def _done(t, key=key):
+            if _inflight.get(key) is t:
+                del _inflight[key]
+        task.add_done_callback(_done)
+        inc_counter("bot_single_flight_total", result="leader")
+    else:
+        inc_counter("bot_single_flight_total", result="coalesced")
+    return await asyncio.shield(task)
+
+def _throttle_reason(user_key):
+    """
+    سبب تجاهل نقرة مكررة لنفس الخدمة: "active" ما زالت قيد التنفيذ (من محادثة أخرى لنفس المستخدم،
+    فتحديثات المحادثة الواحدة تُنفَّذ بالترتيب)، "sent" أُرسل الملف للتو، أو None.
+    """
+    if user_key in _user_active:
+        return "active"
+    last = _user_last_done.get(user_key)
+    if last is not None and time.monotonic() - last < TAP_THROTTLE_SECONDS:
+        return "sent"
+    return None
+
+def _mark_done(user_key):
+    now = time.monotonic()
+    _user_last_done[user_key] = now
+    if len(_user_last_done) > 10000:
+        # تنظيف السجلات القديمة حتى لا يكبر القاموس بلا حد
+        for k, t in list(_user_last_done.items()):
+            if now - t >= TAP_THROTTLE_SECONDS:
+                del _user_last_done[k]
+
+# =========================
+# تجهيز مسبق لجدول المتدرب بعد تسجيل الدخول
+# =========================
+PREFETCH_ON_LOGIN = os.environ.get("PREFETCH_ON_LOGIN", "1") == "1"
+PREFETCH_CONCURRENCY = max(1, int(os.environ.get("PREFETCH_CONCURRENCY", "1")))
+
+_prefetch_semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+_prefetch_tasks = set()   # مراجع للمهام الخلفية حتى لا يجمعها جامع القمامة قبل انتهائها
+
+def _prefetch_busy():
+    """أولوية منخفضة: لا نجهز مسبقًا إذا كان هناك طلبات فعلية تنتظر الضغط أو المسار الثقيل."""
+    return _gs_waiting > 0 or _gs_semaphore.locked() or _heavy_waiting > 0
+
+async def _prefetch_one(service, student_id, pdf_path, pages, version, cache_key):
+    async with _prefetch_semaphore:
+        if _prefetch_busy():
+            inc_counter("bot_prefetch_total", service=service, result="busy")
+            return
+        try:
+            with timed(service, "prefetch"):
+                await single_flight(
+                    cache_key, lambda: _prepare_student_pdf(service, student_id, pdf_path, pages, version, cache_key)
+                )
+            inc_counter("bot_prefetch_total", service=service, result="done")
+        except Exception as e:
+            print(f"⚠️ فشل التجهيز المسبق ({service} / {student_id}): {e}", flush=True)
+
+def prefetch_student(student_id):
+    """
+    بعد نجاح الدخول: البدء بتجهيز الجدول (والمقررات المتبقية إن ظهر زرها) في الخلفية،
+    فتُخدم أول نقرة من الكاش، أو تنضم للتجهيز الجاري عبر single_flight.
+    """
+    if not PREFETCH_ON_LOGIN:
+        return
+    services = ["schedule"]
+    if student_id in (INDEXES.get("remaining") or {}):
+        services.append("remaining")
+
+    for service in services:
+        pdf_path = FILES.get(service)
+        # فهرس لم يُبنَ بعد أو ملف مصدر استُبدل ولم يُعد فهرسته: لا نقتطع صفحات من الملف الجديد بمدى قديم
+        if not _index_usable(service) or not pdf_path or not os.path.exists(pdf_path):
+            continue
+        pages, version = _student_pages(service, student_id)
+        if not pages:
+            continue
+        cache_key = _pdf_cache_key(service, student_id, version)
+        # مرفوع مسبقًا (file_id) أو في كاش الذاكرة: لا حاجة لأي عمل (كاش القرص يُفحص داخل المهمة الخلفية)
+        if _get_file_id(cache_key) or _pdf_memory_has(cache_key):
+            inc_counter("bot_prefetch_total", service=service, result="cached")
+            continue
+        # لا نُكدّس مهام التجهيز المسبق: إن امتلأت الخانات (بما فيها مهام أُنشئت ولم تبدأ بعد)
+        # أو كان هناك ضغط على البوت نتخطى بدل الانتظار
+        if len(_prefetch_tasks) >= PREFETCH_CONCURRENCY or _prefetch_busy():
+            inc_counter("bot_prefetch_total", service=service, result="busy")
+            continue
+        task = asyncio.create_task(_prefetch_one(service, student_id, pdf_path, pages, version, cache_key))
+        _prefetch_tasks.add(task)
+        task.add_done_callback(_prefetch_tasks.discard)
+
+# =========================
+# إرسال الخدمات
+# =========================
 async def send_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE, service: str):
+    global _requests_in_flight
+    user = getattr(update, "effective_user", None)
+    user_key = (user.id if user else context.user_data.get("student_id"), service)
+    throttled = service in THROTTLED_SERVICES
+    reason = _throttle_reason(user_key) if throttled else None
+    if reason:
+        inc_counter("bot_throttled_taps_total", service=service, reason=reason)
+        print(f"⏱️ نقرة مكررة ({service}) من المستخدم {user_key[0]}", flush=True)
+        if reason == "active":
+            await update.message.reply_text("⏳ طلبك قيد التجهيز، لحظات...")
+        else:
+            await update.message.reply_text("✅ تم إرسال الملف للتو، تجده في الأعلى.")
+        return
+
+    if throttled:
+        _user_active.add(user_key)
+    with _metrics_lock:
+        _requests_in_flight += 1
+    sent = False
+    try:
+        with timed(service, "total"):
+            sent = await _send_pdf(update, context, service)
+    finally:
+        with _metrics_lock:
+            _requests_in_flight -= 1
+        if throttled:
+            _user_active.discard(user_key)
+            # الفشل لا يبدأ مهلة التجاهل: يستطيع المستخدم إعادة المحاولة فورًا
+            if sent:
+                _mark_done(user_key)
+
+async def _send_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE, service: str):
     student_id = context.user_data.get("student_id")
     if not student_id:
         await update.message.reply_text("⚠️ الرجاء إدخال رقمك التدريبي أولاً.")
         return
 
+    # ⏳ بعد إعادة التشغيل قد يكون الفهرس قيد البناء: ننتظر قليلًا بدل الرد بعدم وجود بيانات
+    if not await _ensure_index_ready(update, SERVICE_INDEX.get(service, service)):
+        return
+
     if service == "advisor":
         await send_advisor(update, context, student_id)
         return
@@ -491,55 +2099,29 @@ async def send_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE, service:
     sent_msg = await update.message.reply_text(messages.get(service, "⏳ جاري تجهيز الملف..."))
 
     pdf_path = FILES.get(service)
-    index = INDEXES.get(service)
     if not pdf_path or not os.path.exists(pdf_path):
         await sent_msg.delete()
         await update.message.reply_text("❌ الملف المطلوب غير متاح حالياً.")
         return
 
     try:
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
+        with timed(service, "lookup"):
+            pages, version = _student_pages(service, student_id)
+            cache_key = _pdf_cache_key(service, student_id, version)
 
-        if service == "remaining":
-            pages = index.get(student_id, [])
-            if not pages:
-                await sent_msg.delete()
+        if not pages:
+            if service == "remaining":
                 await update.message.reply_text(f"❌ لم يتم العثور على مقررات المتدرب {student_id}.")
-                return
-            for i in pages:
-                writer.add_page(reader.pages[i])
-        else:
-            if student_id not in index:
-                await sent_msg.delete()
+            else:
                 await update.message.reply_text("❌ لم يتم العثور على بياناتك.")
-                return
-            start = index[student_id]
-            sorted_students = sorted(index.items(), key=lambda x: x[1])
-            # احصل على نهاية مقطع الطالب عبر الطالب التالي
-            end = len(reader.pages)
-            for sid, page_idx in sorted_students:
-                if page_idx > start:
-                    end = page_idx
-                    break
-            for i in range(start, end):
-                writer.add_page(reader.pages[i])
+            return
 
-        output_file = f"{service}_{student_id}.pdf"
-        with open(output_file, "wb") as f:
-            writer.write(f)
-
-        compressed = f"compressed_{service}_{student_id}.pdf"
-        # 📦 ضغط الملف قبل الإرسال
-        if service == "remaining":
-            # نضغط ملف المقررات المتبقية إلزاميًا حتى يكون أسرع في التحميل
-            success = compress_pdf_with_ghostscript(output_file, compressed)
-            if not success:
-                print("⚠️ فشل الضغط، سيتم إرسال النسخة الأصلية.", flush=True)
-                compressed = output_file
-        else:
-            # باقي الخدمات تُضغط كالمعتاد فقط
-            compress_pdf_with_ghostscript(output_file, compressed)
+        async def load_document():
+            # 🔗 طلبان متزامنان لنفس الملف (تجهيز مسبق ونقرة، أو نقرتان من محادثتين مختلفتين) يشتركان في استخراج وضغط واحد؛
+            # نقرتا المحادثة الواحدة لا تتزامنان لأن تحديثاتها تُنفَّذ بالترتيب
+            return await single_flight(
+                cache_key, lambda: _prepare_student_pdf(service, student_id, pdf_path, pages, version, cache_key)
+            )
 
         captions = {
             "schedule": f"📄 جدول المتدرب رقم {student_id}",
@@ -547,23 +2129,23 @@ async def send_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE, service:
             "gpa": f"🎓 المعدل للمتدرب رقم {student_id}",
         }
 
-        await update.message.reply_document(
-            open(compressed, "rb"),
+        await _reply_document_cached(
+            update.message,
+            cache_key,
+            load_document,
             filename=f"{service}_{student_id}.pdf",
-            caption=captions.get(service, f"📄 ملف {service} للمتدرب {student_id}")
+            caption=captions.get(service, f"📄 ملف {service} للمتدرب {student_id}"),
+            service=service,
         )
+        return True
+    except SourceChanged:
+        # الملف استُبدل بعد فحص الجاهزية: الفهرس الجديد قيد البناء
+        await update.message.reply_text("⚠️ تم تحديث الملف للتو، حاول مرة أخرى بعد قليل.")
     except Exception as e:
         await update.message.reply_text(f"❌ حدث خطأ أثناء تجهيز الملف: {e}")
         import traceback; traceback.print_exc()
     finally:
         await sent_msg.delete()
-        try:
-            if os.path.exists(output_file):
-                os.remove(output_file)
-            if os.path.exists(compressed) and compressed != output_file:
-                os.remove(compressed)
-        except Exception:
-            pass
 
 # =========================
 # دالة مساعدة لبناء لوحة الأزرار
@@ -638,6 +2220,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # ✅ استخدم دالة موحدة لبناء لوحة الأزرار حسب حالة المتدرب
         keyboard = build_main_keyboard(last_id)
+        prefetch_student(last_id)
 
         await update.message.reply_text(
             f"✅ تم تسجيل دخولك مجددًا بالرقم ({last_id}).\nاختر الخدمة:",
@@ -666,24 +2249,28 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         pending_id = context.user_data.get("pending_student_id")
+        if not await _ensure_index_ready(update, "ids"):
+            return
         ids_map = INDEXES.get("ids") or {}
         rec = ids_map.get(pending_id)
 
-        if not rec or "nid" not in rec:
+        if not rec or not rec.nid:
             await update.message.reply_text("⚠️ لا توجد بيانات هوية مرتبطة بهذا الرقم التدريبي. تواصل مع الدعم.")
             return
 
-        if normalize_digits(str(rec["nid"])) != entered_nid:
+        if normalize_digits(rec.nid) != entered_nid:
             await update.message.reply_text("❌ رقم الهوية غير مطابق لرقم المتدرب. حاول مرة أخرى.")
             return
 
         context.user_data["student_id"] = pending_id
         context.user_data.pop("pending_student_id", None)
 
-        full_name = rec.get("name", "").strip()
+        full_name = rec.name.strip()
         first_name = extract_first_name(full_name)
 
         keyboard = build_main_keyboard(pending_id)
+        # ⚡ تجهيز الجدول في الخلفية لأنه غالبًا أول زر يُضغط
+        prefetch_student(pending_id)
 
         await update.message.reply_text(
             f"🎉 أهلاً وسهلاً {first_name}!\nالآن يمكنك الاستفادة من خدماتك:",
@@ -714,16 +2301,368 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "⚠️ يرجى إدخال رقم تدريبي صحيح يبدأ بـ 44 أو اختر خدمة من الأزرار."
     )
 
+# =========================
+# حفظ جلسات المستخدمين في SQLite (حتى لا يُسجَّل خروج الجميع مع كل إعادة تشغيل)
+# =========================
+SESSION_DB = os.environ.get("SESSION_DB", "sessions.sqlite3")                    # فارغ = بدون حفظ
+SESSION_SYNC_INTERVAL = float(os.environ.get("SESSION_SYNC_INTERVAL", "10"))     # كل كم ثانية تُسلَّم التغييرات للتخزين
+SESSION_FLUSH_DELAY = float(os.environ.get("SESSION_FLUSH_DELAY", "1"))          # نافذة تجميع الكتابات في دفعة واحدة
+SESSION_BATCH_MAX = int(os.environ.get("SESSION_BATCH_MAX", "500"))              # كتابة فورية إذا تجاوزت الدفعة هذا العدد
+
+class SQLitePersistence(BasePersistence):
+    """
+    تخزين user_data و chat_data و bot_data في SQLite مع كتابة مؤجلة (write-behind):
+    التغييرات تُجمع في الذاكرة وتُكتب في معاملة واحدة بعد SESSION_FLUSH_DELAY،
+    والتحميل عند الإقلاع استعلام واحد لكل نوع.
+    """
+
+    def __init__(self, path, update_interval=SESSION_SYNC_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "kind TEXT NOT NULL, key INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (kind, key))"
+        )
+        self._db_lock = threading.Lock()
+        self._pending = {}   # (النوع، المعرف) -> JSON أو None للحذف
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    # ---------- القراءة (مرة واحدة عند الإقلاع) ----------
+    def _load(self, kind):
+        with self._db_lock:
+            rows = self._conn.execute("SELECT key, data FROM sessions WHERE kind = ?", (kind,)).fetchall()
+        return {key: json.loads(data) for key, data in rows}
+
+    async def get_user_data(self):
+        data = await asyncio.to_thread(self._load, "user")
+        print(f"💾 تم استرجاع جلسات {len(data)} مستخدم من {self.path}", flush=True)
+        return data
+
+    async def get_chat_data(self):
+        return await asyncio.to_thread(self._load, "chat")
+
+    async def get_bot_data(self):
+        return (await asyncio.to_thread(self._load, "bot")).get(0, {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    # ---------- الكتابة المؤجلة ----------
+    def _write(self, batch):
+        upserts = [(kind, key, data) for (kind, key), data in batch.items() if data is not None]
+        deletes = [(kind, key) for (kind, key), data in batch.items() if data is None]
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO sessions (kind, key, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data",
+                    upserts,
+                )
+                self._conn.executemany("DELETE FROM sessions WHERE kind = ? AND key = ?", deletes)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def _flush_pending(self):
+        # القفل يضمن كتابة الدفعات بترتيب تكوينها فلا تطغى دفعة قديمة على أحدث منها
+        async with self._flush_lock:
+            batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                print(f"⚠️ تعذر حفظ الجلسات ({len(batch)} سجل): {e}", flush=True)
+                import traceback; traceback.print_exc()
+                # نعيدها للدفعة التالية دون أن نغطي على تغييرات أحدث
+                for key, data in batch.items():
+                    self._pending.setdefault(key, data)
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(SESSION_FLUSH_DELAY)
+        self._flush_task = None   # ما يصل أثناء الكتابة يُجدول له دفعة جديدة
+        await self._flush_pending()
+
+    async def _stage(self, kind, key, data):
+        self._pending[(kind, key)] = None if data is None else json.dumps(data, ensure_ascii=False)
+        if len(self._pending) >= SESSION_BATCH_MAX:
+            await self._flush_pending()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def update_user_data(self, user_id, data):
+        await self._stage("user", user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._stage("chat", chat_id, data)
+
+    async def update_bot_data(self, data):
+        await self._stage("bot", 0, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._stage("user", user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        await self._stage("chat", chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """عند الإيقاف: كتابة ما تبقى في الدفعة وإغلاق القاعدة."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush_pending()
+        with self._db_lock:
+            self._conn.close()
+        print("💾 تم حفظ الجلسات قبل الإيقاف.", flush=True)
+
+# =========================
+# معالجة التحديثات بالتوازي مع الحفاظ على ترتيب كل محادثة
+# =========================
+UPDATE_CONCURRENCY = max(1, int(os.environ.get("UPDATE_CONCURRENCY", "64")))   # حد التحديثات الخفيفة الجارية (الدخول، المرشد، المعدل)
+HEAVY_CONCURRENCY = max(1, int(os.environ.get("HEAVY_CONCURRENCY", "4")))      # حد خدمات PDF الثقيلة
+HEAVY_BUTTONS = {"📄 جدولي", "📚 مقرراتي المتبقية", "📑 خطتي التفصيلية"}
+# حد PTB نفسه يُؤخذ قبل do_process_update فيحجز مكانًا لكل تحديث منتظر؛ نجعله بلا أثر ونطبق الحدود داخل المسارين
+_UNBOUNDED_UPDATES = 1_000_000
+
+_heavy_waiting = 0   # طلبات PDF تنتظر دورها في المسار الثقيل (تظهر في /metrics)
+_light_waiting = 0   # تحديثات خفيفة تنتظر مكانًا في مسارها
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    تحديثات المحادثات المختلفة تُعالج بالتوازي، وتحديثات المحادثة الواحدة بترتيب وصولها
+    (حتى لا تتسابق خطوتا رقم المتدرب ثم الهوية في handle_text).
+    خدمات PDF تمر بمسار مستقل محدود بـ HEAVY_CONCURRENCY، وبقية التحديثات بمسار محدود بـ UPDATE_CONCURRENCY؛
+    ولا يُحجز مكان في أي مسار إلا بعد دور المحادثة، فطابور طلبات PDF لا يؤخر الدخول والخدمات الخفيفة.
+    """
+
+    def __init__(self, max_concurrent_updates=UPDATE_CONCURRENCY, heavy_limit=HEAVY_CONCURRENCY):
+        super().__init__(_UNBOUNDED_UPDATES)
+        self._chat_locks = {}   # معرف المحادثة -> [القفل، عدد المنتظرين]
+        self._light = asyncio.Semaphore(max_concurrent_updates)
+        self._heavy = asyncio.Semaphore(heavy_limit)
+
+    @staticmethod
+    def _chat_key(update):
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return chat.id
+        user = getattr(update, "effective_user", None)
+        return user.id if user is not None else None
+
+    @staticmethod
+    def _is_heavy(update):
+        message = getattr(update, "message", None)
+        return bool(message and message.text and message.text.strip() in HEAVY_BUTTONS)
+
+    async def _run_in_lane(self, update, coroutine):
+        global _heavy_waiting, _light_waiting
+        heavy = self._is_heavy(update)
+        semaphore = self._heavy if heavy else self._light
+        if heavy:
+            _heavy_waiting += 1
+        else:
+            _light_waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            if heavy:
+                _heavy_waiting -= 1
+            else:
+                _light_waiting -= 1
+        try:
+            await coroutine
+        finally:
+            semaphore.release()
+
+    async def do_process_update(self, update, coroutine):
+        key = self._chat_key(update)
+        if key is None:
+            await self._run_in_lane(update, coroutine)
+            return
+
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run_in_lane(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+# =========================
+# خادم HTTP: حالة البوت + استقبال Webhook من تيليجرام
+# =========================
+HTTP_PORT = int(os.environ.get("PORT") or os.environ.get("STATUS_PORT") or 0)   # 0 = بدون خادم (وضع polling فقط)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")   # مثال: https://my-bot.onrender.com (يفعّل وضع webhook)
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or (
+    hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32] if BOT_TOKEN else ""
+)
+
+_webhook_target = {"app": None, "loop": None}   # التطبيق وحلقته لتمرير التحديثات من خيط الخادم
+
+def _indexes_status():
+    return {
+        name: {"ready": INDEX_READY[name].is_set(), "size": len(INDEXES.get(name) or {})}
+        for name in INDEXES
+    }
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    """/status و /healthz و /metrics للمراقبة، و WEBHOOK_PATH لاستقبال تحديثات تيليجرام."""
+
+    def _send(self, code, body, content_type="application/json; charset=utf-8"):
+        data = body if isinstance(body, bytes) else body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/status":
+            body = dict(_get_status(), indexes=_indexes_status())
+            body.pop("last_user", None)   # المنفذ عام (نفس منفذ الـ webhook): لا نكشف أرقام المتدربين
+            self._send(200, json.dumps(body, ensure_ascii=False))
+        elif path == "/metrics":
+            self._send(200, render_metrics(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path in ("/healthz", "/"):
+            ok = _get_status().get("running")
+            self._send(200 if ok else 503, "ok" if ok else "stopped", "text/plain; charset=utf-8")
+        else:
+            self._send(404, "not found", "text/plain; charset=utf-8")
+
+    def do_POST(self):
+        if urlparse(self.path).path != WEBHOOK_PATH or not WEBHOOK_URL:
+            self._send(404, "not found", "text/plain; charset=utf-8")
+            return
+        if self.headers.get("X-Telegram-Bot-Api-Secret-Token", "") != WEBHOOK_SECRET:
+            self._send(403, "forbidden", "text/plain; charset=utf-8")
+            return
+        app, loop = _webhook_target["app"], _webhook_target["loop"]
+        if app is None or loop is None:
+            self._send(503, "starting", "text/plain; charset=utf-8")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            update = Update.de_json(payload, app.bot)
+        except Exception as e:
+            print(f"⚠️ تحديث webhook غير صالح: {e}", flush=True)
+            self._send(400, "bad request", "text/plain; charset=utf-8")
+            return
+        # نرد فورًا ويُعالج التحديث في حلقة التطبيق
+        asyncio.run_coroutine_threadsafe(app.update_queue.put(update), loop)
+        self._send(200, "ok", "text/plain; charset=utf-8")
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port):
+    server = ThreadingHTTPServer(("0.0.0.0", port), StatusRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🌐 خادم الحالة يعمل على المنفذ {port} (/status, /healthz, /metrics)", flush=True)
+    return server
+
+async def run_webhook(app, post_init):
+    """تشغيل التطبيق بوضع webhook: تيليجرام يرسل التحديثات إلى خادمنا بدل الاستطلاع المستمر."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass   # ويندوز: KeyboardInterrupt يكفي
+
+    async with app:
+        await post_init(app)
+        await app.start()
+        _webhook_target.update(app=app, loop=loop)
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        print(f"🔗 وضع webhook مفعّل: {WEBHOOK_URL + WEBHOOK_PATH}", flush=True)
+        try:
+            await stop_event.wait()
+        finally:
+            _webhook_target.update(app=None, loop=None)
+            await app.stop()
+
 # =========================
 # التشغيل الرئيسي
 # =========================
 def main():
+    imported_at = time.perf_counter()
+    if not BOT_TOKEN:
+        print("❌ لم يتم العثور على متغير TELEGRAM_TOKEN. ضعه في إعدادات الخادم أو عرّفه محليًا للتجربة.", flush=True)
+        sys.exit(1)
+
     _set_status(running=True, telegram_connected=False)
-    # شغّل الفهرسة بالخلفية
-    threading.Thread(target=initialize_indexes, daemon=True).start()
+    # ⚡ الفهارس السليمة في اللقطة تُحمَّل فورًا، والباقي يُبنى بالخلفية
+    baseline = _stat_sources()
+    ready = load_snapshot()
+    boot_seconds = time.perf_counter() - _BOOT_STARTED
+    _set_status(boot_seconds=round(boot_seconds, 3))
+    print(
+        f"⏱️ زمن الإقلاع: {boot_seconds:.2f} ثانية "
+        f"(الاستيراد {imported_at - _BOOT_STARTED:.2f} + تحميل الفهارس {time.perf_counter() - imported_at:.2f})",
+        flush=True,
+    )
+
+    def index_then_watch():
+        _get_file_id("")   # تحميل سجل file_id مسبقًا خارج حلقة asyncio
+        initialize_indexes(ready)
+        # 🔄 بعد الفهرسة الأولى نراقب الملفات لإعادة بناء ما يتغير فقط
+        watch_sources(baseline)
+
+    threading.Thread(target=index_then_watch, daemon=True).start()
 
     print("🚀 تشغيل البوت...", flush=True)
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    # ⚡ معالجة متوازية: ترتيب ثابت داخل كل محادثة، وخدمات PDF في مسار مستقل
+    builder = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(ChatOrderedUpdateProcessor())
+    if SESSION_DB:
+        # 💾 جلسات الدخول تبقى بعد إعادة التشغيل
+        builder = builder.persistence(SQLitePersistence(SESSION_DB))
+    app = builder.build()
 
     # 🟢 معالجات الأوامر والرسائل
     app.add_handler(CommandHandler("start", start))
@@ -742,6 +2681,7 @@ def main():
 
             # إعادة تخزين رقم المتدرب
             context.user_data["student_id"] = last_id
+            prefetch_student(last_id)
 
             # تعديل الرسالة الأصلية لتأكيد الدخول
             await query.edit_message_text(
@@ -775,13 +2715,20 @@ def main():
 
     app.post_init = post_init
 
+    # 🌐 خادم الحالة (وهو نفسه مستقبل webhook إن كان مفعّلًا)
+    if HTTP_PORT or WEBHOOK_URL:
+        start_http_server(HTTP_PORT or 8080)
+
     print("✅ البوت جاهز لاستقبال الطلبات الآن.", flush=True)
 
     # =========================
     # تشغيل البوت
     # =========================
     try:
-        app.run_polling(allowed_updates=Update.ALL_TYPES)
+        if WEBHOOK_URL:
+            asyncio.run(run_webhook(app, post_init))
+        else:
+            app.run_polling(allowed_updates=Update.ALL_TYPES)
     except KeyboardInterrupt:
         pass
     finally:
@@ -793,9 +2740,9 @@ def main():
             index_progress=0.0
         )
         print("👋 تم إيقاف البوت، يتم إنهاء جميع العمليات...", flush=True)
+        flush_file_ids()
         try:
-            import os as _os, signal as _signal
-            _os.kill(_os.getpid(), _signal.SIGTERM)
+            os.kill(os.getpid(), signal.SIGTERM)
         except Exception as e:
             print("⚠️ فشل إنهاء العملية:", e, flush=True)
         time.sleep(0.2)
@@ -803,4 +2750,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    if "--presplit" in sys.argv[1:]:
+        presplit_all()
+    else:
+        main()
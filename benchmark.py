@@ -0,0 +1,445 @@
+# benchmark.py
+"""
+قياس أداء البوت على بيانات اصطناعية قبل النشر:
+- توليد ملفات PDF (الجداول، المقررات المتبقية، المعدلات) وملفات CSV (الهويات، المرشدين) بعدد متدربين قابل للضبط.
+- تشغيل handle_text / send_pdf عبر Application حقيقي متصل بخادم محلي يحاكي Telegram Bot API.
+- تقرير: زمن الفهرسة، زمن الإقلاع من اللقطة، p50/p99 لكل خدمة، وأعلى استهلاك للذاكرة (RSS).
+
+الاستخدام:
+    python benchmark.py --students 1000 --sample 200
+    python benchmark.py --students 50000 --sample 500 --concurrency 8 --json result.json
+"""
+import os
+import io
+import sys
+import csv
+import json
+import math
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource   # غير متوفر على Windows
+except ImportError:
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ملفات تنتجها الفهرسة والكاش ويجب حذفها لقياس تشغيل بارد
+ARTIFACTS = (
+    "schedule_index.json", "remaining_index.json", "gpa_index.json", "advisor_index.json",
+    "majors_index.json", "indexes.snapshot", "file_ids.json", "bot_status.json",
+    "file_ids.sqlite3", "file_ids.sqlite3-wal", "file_ids.sqlite3-shm",
+    "sessions.sqlite3", "sessions.sqlite3-wal", "sessions.sqlite3-shm",
+    "pdf_cache", "presplit",
+)
+
+# =========================
+# توليد البيانات الاصطناعية
+# =========================
+def write_pdf(path, pages_lines):
+    """كتابة PDF نصي بسيط: صفحة لكل قائمة أسطر (دون مكتبات خارجية حتى يبقى التوليد سريعًا)."""
+    n = len(pages_lines)
+    with open(path, "wb") as f:
+        offsets = []
+        pos = 0
+
+        def emit(data):
+            nonlocal pos
+            f.write(data)
+            pos += len(data)
+
+        def obj(num, body):
+            offsets.append(pos)
+            emit(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+        emit(b"%PDF-1.4\n")
+        obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(n)).encode()
+        obj(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % n)
+        obj(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        for i, lines in enumerate(pages_lines):
+            obj(4 + 2 * i, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                           b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i))
+            stream = "\n".join(["BT /F1 11 Tf 14 TL 40 760 Td"] + [f"({line}) Tj T*" for line in lines] + ["ET"]).encode()
+            obj(5 + 2 * i, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+        xref = pos
+        emit(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+        emit(b"".join(b"%010d 00000 n \n" % o for o in offsets))
+        emit(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, xref))
+
+def generate_dataset(workdir, count, seed=1447):
+    """توليد بيانات count متدرب في workdir بنفس أسماء الملفات وصيغها التي يقرأها البوت."""
+    rng = random.Random(seed)
+    courses = [f"{code}{num}" for code in ("ACC", "MGT", "HRM", "ENG", "CIT", "MTH") for num in (101, 102, 201, 202, 241)]
+    programs = [" تقنية الموارد البشرية-تقنية", "الإدارة المكتبية", "المحاسبة", "السلامة المهنية"]
+
+    students = []
+    for i in range(count):
+        sid = f"44{i + 1:07d}"
+        nid = f"1{rng.randrange(10 ** 9):09d}"
+        students.append({
+            "sid": sid,
+            "nid": nid,
+            "gpa": f"{rng.uniform(2.0, 5.0):.2f}",
+            "program": rng.choice(programs),
+            "has_remaining": rng.random() < 0.6,
+            "in_gpa_pdf": rng.random() < 0.8,
+        })
+
+    # جدول لكل متدرب في صفحة أو صفحتين
+    schedule_pages = []
+    for s in students:
+        lines = [f"Trainee {s['sid']} Semester 1447"] + [
+            f"{c}  Sun-Tue 08:00-09:40  Room {rng.randint(100, 400)}" for c in rng.sample(courses, 6)
+        ]
+        schedule_pages.append(lines)
+        if rng.random() < 0.2:
+            schedule_pages.append([f"{c}  Wed 10:00-11:40  Lab {rng.randint(1, 9)}" for c in rng.sample(courses, 4)])
+    write_pdf(os.path.join(workdir, "Scheduals.pdf"), schedule_pages)
+
+    remaining_pages = [
+        [f"Trainee {s['sid']} remaining courses"] + rng.sample(courses, rng.randint(2, 8))
+        for s in students if s["has_remaining"]
+    ]
+    write_pdf(os.path.join(workdir, "Remaining.pdf"), remaining_pages or [["empty"]])
+
+    gpa_lines = [f"{s['sid']}  {s['gpa']}" for s in students if s["in_gpa_pdf"]]
+    gpa_pages = [gpa_lines[i:i + 40] for i in range(0, len(gpa_lines), 40)]
+    write_pdf(os.path.join(workdir, "GPA.pdf"), gpa_pages or [["empty"]])
+
+    with open(os.path.join(workdir, "IDs.csv"), "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(["الفصل التدريبي", "الوحدة التدريبية", "المرحلة", "القسم", "البرنامج",
+                         "رقم المتدرب", "اسم المتدرب", "المعدل التراكمي", "السجل المدني", "الجنس", "الجنسية", "رقم الجوال"])
+        for s in students:
+            writer.writerow(["الفصل التدريبي الأول 1447", "كلية البيئة ببريدة", "دبلوم", "تقنية الاعمال", s["program"],
+                             s["sid"], f"متدرب {s['sid']} الاختباري", s["gpa"], s["nid"], "ذكر", "السعودية",
+                             f"05{rng.randrange(10 ** 8):08d}"])
+
+    # ملف المرشدين بنفس صيغة التصدير الأصلية: كل سطر CSV داخل حقل واحد بين علامتي تنصيص
+    header = ["الفصل التدريبي", "الوحدة التدريبية", "القسم ", "التخصص", "رقم المرشد", "اسم المرشد", "حالة المرشد",
+              "رقم المتدرب", "اسم المتدرب", "الوحدة التدريبية للمتدربـ/ـه", "القسم للمتدربـ/ـه",
+              "التخصص للمتدربـ/ـه", "نوع التدريب", "فصل بداية الإرشاد", "تاريخ بداية الإرشاد"]
+    advisors = [(f"{rng.randrange(10 ** 7):07d}", f"مرشد رقم {k}") for k in range(max(1, count // 40))]
+    with open(os.path.join(workdir, "Advisors.csv"), "w", encoding="utf-8-sig", newline="") as f:
+        outer = csv.writer(f, quoting=csv.QUOTE_ALL)
+
+        def inner(fields):
+            buf = io.StringIO()
+            csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator="").writerow(fields)
+            return buf.getvalue()
+
+        outer.writerow([inner(header)])
+        for s in students:
+            adv_id, adv_name = rng.choice(advisors)
+            outer.writerow([inner(["الفصل التدريبي الأول 1447", "كلية البيئة ببريدة", "تقنية الاعمال", "تقنية الموارد البشرية",
+                                   adv_id, adv_name, "مرشد أكاديمي", s["sid"], f"متدرب {s['sid']}",
+                                   "كلية البيئة ببريدة", "تقنية الاعمال", "تقنية الموارد البشرية", "صباحي", "144610", "2025-09-14"])])
+
+    return students
+
+def clean_artifacts(workdir):
+    for name in ARTIFACTS:
+        path = os.path.join(workdir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            for p in (path, path + ".meta"):
+                if os.path.exists(p):
+                    os.remove(p)
+
+# =========================
+# خادم محلي يحاكي Telegram Bot API
+# =========================
+class FakeTelegram:
+    """يستقبل طلبات Bot API على المنفذ المحلي ويرد بنتائج صالحة دون أي اتصال خارجي."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.calls = {}           # الطريقة -> عدد الاستدعاءات
+        self.uploaded_bytes = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True   # بدونه يضيف تأخير ACK حوالي 40ms لكل رد فيغطي على زمن البوت
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                method = self.path.rsplit("/", 1)[-1]
+                result = fake.respond(method, body)
+                data = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def respond(self, method, body):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.next_id += 1
+            msg_id = self.next_id
+            if method == "sendDocument":
+                self.uploaded_bytes += len(body)
+
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        if method in ("deleteMessage", "answerCallbackQuery", "deleteWebhook", "setWebhook"):
+            return True
+        message = {"message_id": msg_id, "date": int(time.time()), "chat": {"id": 1, "type": "private"}}
+        if method == "sendDocument":
+            message["document"] = {"file_id": f"BENCH-{msg_id}", "file_unique_id": f"U{msg_id}"}
+        return message
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# =========================
+# أدوات القياس
+# =========================
+def percentile(values, q):
+    """النسبة المئوية بطريقة أقرب رتبة."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+def peak_rss_mb():
+    """أعلى RSS للعملية الحالية ولأبنائها (عمليات الفهرسة وGhostscript) بالميغابايت."""
+    if resource is None:
+        return None, None
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024   # macOS بالبايت و Linux بالكيلوبايت
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor
+    return self_rss, children_rss
+
+def measure_startup(workdir, runs=3):
+    """زمن الإقلاع في عملية جديدة: استيراد Bot ثم تحميل الفهارس من اللقطة."""
+    code = (
+        "import time, json\n"
+        "t0 = time.perf_counter()\n"
+        "import Bot\n"
+        "t1 = time.perf_counter()\n"
+        "ready = Bot.load_snapshot()\n"
+        "t2 = time.perf_counter()\n"
+        "print('BENCH ' + json.dumps({'import': t1 - t0, 'snapshot': t2 - t1, 'ready': sorted(ready)}))\n"
+    )
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    env.setdefault("TELEGRAM_TOKEN", "0:benchmark")
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, capture_output=True, text=True)
+        total = time.perf_counter() - t0
+        line = next((l for l in out.stdout.splitlines() if l.startswith("BENCH ")), None)
+        if line is None:
+            raise RuntimeError(f"startup probe failed: {out.stderr[-500:]}")
+        sample = json.loads(line[6:])
+        sample["process"] = total
+        samples.append(sample)
+    return min(samples, key=lambda s: s["process"])
+
+# =========================
+# تشغيل السيناريو
+# =========================
+SERVICE_BUTTONS = {
+    "schedule": "📄 جدولي",
+    "remaining": "📚 مقرراتي المتبقية",
+    "advisor": "👨‍🏫 مرشدي التدريبي",
+    "gpa": "🎓 معدلي",
+}
+
+async def drive(Bot, students, args):
+    """محاكاة متدربين: تسجيل دخول على خطوتين ثم الضغط على أزرار الخدمات مرتين (بارد ثم دافئ)."""
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+    fake = FakeTelegram().start()
+    app = (
+        ApplicationBuilder()
+        .token("0:benchmark")
+        .base_url(f"http://127.0.0.1:{fake.port}/bot")
+        .base_file_url(f"http://127.0.0.1:{fake.port}/file/bot")
+        .concurrent_updates(Bot.ChatOrderedUpdateProcessor())
+        .build()
+    )
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, Bot.handle_text))
+    await app.initialize()
+
+    latencies = {}
+    update_id = 0
+
+    async def send(user_id, text, label):
+        nonlocal update_id
+        update_id += 1
+        update = Update.de_json({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Trainee"},
+                "text": text,
+            },
+        }, app.bot)
+        t0 = time.perf_counter()
+        # نفس مسار التشغيل الفعلي: معالج التحديثات (ترتيب المحادثة + المسار الثقيل) ثم المعالجات
+        await app.update_processor.process_update(update, app.process_update(update))
+        latencies.setdefault(label, []).append(time.perf_counter() - t0)
+
+    async def session(user_id, student):
+        await send(user_id, student["sid"], "login_id")
+        await send(user_id, student["nid"], "login_nid")
+        for rnd in ("", " (warm)"):
+            for service, button in SERVICE_BUTTONS.items():
+                if service == "remaining" and not student["has_remaining"]:
+                    continue
+                await send(user_id, button, service + rnd)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_id, student):
+        async with semaphore:
+            await session(user_id, student)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(limited(1000 + i, s) for i, s in enumerate(students)))
+    wall = time.perf_counter() - t0
+
+    await app.shutdown()
+    fake.stop()
+    return latencies, wall, fake
+
+def run(args):
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="bot-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    report = {"students": args.students, "workdir": workdir, "ghostscript": bool(shutil.which("gs"))}
+
+    print(f"🧪 توليد بيانات {args.students} متدرب في {workdir} ...", flush=True)
+    t0 = time.perf_counter()
+    students = generate_dataset(workdir, args.students, seed=args.seed)
+    clean_artifacts(workdir)
+    report["generate_s"] = time.perf_counter() - t0
+
+    os.chdir(workdir)
+    os.environ.setdefault("TELEGRAM_TOKEN", "0:benchmark")
+    # الجولة الدافئة تعيد نفس الأزرار مباشرة، فلا نريد أن يتجاهلها الحد من النقرات المتكررة
+    os.environ.setdefault("TAP_THROTTLE_SECONDS", "0")
+    if args.workers:
+        os.environ["INDEX_WORKERS"] = str(args.workers)
+    sys.path.insert(0, REPO_DIR)
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        t0 = time.perf_counter()
+        import Bot
+        report["import_s"] = time.perf_counter() - t0
+
+        # فهرسة باردة لكل المصادر ثم حفظ اللقطة
+        t0 = time.perf_counter()
+        Bot.initialize_indexes(())
+        report["indexing_s"] = time.perf_counter() - t0
+        report["index_sizes"] = {name: len(Bot.INDEXES.get(name) or {}) for name in Bot.INDEXES}
+
+    print("🚀 قياس زمن الإقلاع من اللقطة ...", flush=True)
+    report["startup"] = measure_startup(workdir)
+
+    sample = random.Random(args.seed).sample(students, min(args.sample, len(students)))
+    print(f"📨 محاكاة {len(sample)} متدرب (التزامن: {args.concurrency}) ...", flush=True)
+    with quiet:
+        latencies, wall, fake = asyncio.run(drive(Bot, sample, args))
+
+    report["wall_s"] = wall
+    report["api_calls"] = fake.calls
+    report["uploaded_mb"] = fake.uploaded_bytes / (1024 * 1024)
+    report["latency_ms"] = {
+        label: {
+            "n": len(values),
+            "p50": percentile(values, 0.50) * 1000,
+            "p99": percentile(values, 0.99) * 1000,
+            "max": max(values) * 1000,
+        }
+        for label, values in sorted(latencies.items())
+    }
+    # متوسط كل مرحلة من المقاييس التي يجمعها البوت نفسه (/metrics)
+    report["stages_ms"] = {
+        f"{service}/{stage}": hist[1] / hist[2] * 1000
+        for (service, stage), hist in sorted(Bot._histograms.items()) if hist[2]
+    }
+    self_rss, children_rss = peak_rss_mb()
+    report["peak_rss_mb"] = {"self": self_rss, "children": children_rss}
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 تم حفظ النتائج في {args.json}", flush=True)
+
+    if not args.keep and not args.workdir:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def print_report(report):
+    startup = report["startup"]
+    rss = report["peak_rss_mb"]
+    print("\n========== نتائج القياس ==========")
+    print(f"المتدربون: {report['students']}   Ghostscript: {'متوفر' if report['ghostscript'] else 'غير متوفر (بدون ضغط)'}")
+    print(f"توليد البيانات: {report['generate_s']:.2f}s   استيراد Bot: {report['import_s']:.2f}s")
+    print(f"الفهرسة الباردة: {report['indexing_s']:.2f}s   أحجام الفهارس: {report['index_sizes']}")
+    print(f"الإقلاع من اللقطة: {startup['process']:.2f}s (استيراد {startup['import']:.2f}s + لقطة {startup['snapshot']:.3f}s)")
+    print(f"زمن المحاكاة الكلي: {report['wall_s']:.2f}s   رُفع: {report['uploaded_mb']:.1f} MB   استدعاءات API: {report['api_calls']}")
+    print(f"\n{'الخدمة':<20}{'n':>6}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, row in report["latency_ms"].items():
+        print(f"{label:<20}{row['n']:>6}{row['p50']:>10.1f}{row['p99']:>10.1f}{row['max']:>10.1f}")
+    if report["stages_ms"]:
+        print("\nمتوسط المراحل (ms):")
+        for key, value in report["stages_ms"].items():
+            print(f"  {key:<28}{value:>10.2f}")
+    if rss["self"] is not None:
+        print(f"\nأعلى RSS: العملية {rss['self']:.0f} MB، العمليات الفرعية {rss['children']:.0f} MB")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="قياس أداء البوت على بيانات اصطناعية")
+    parser.add_argument("--students", type=int, default=1000, help="عدد المتدربين في البيانات المولدة (1000–50000)")
+    parser.add_argument("--sample", type=int, default=200, help="عدد المتدربين الذين تُحاكى جلساتهم")
+    parser.add_argument("--concurrency", type=int, default=1, help="عدد الجلسات المتزامنة")
+    parser.add_argument("--workers", type=int, default=0, help="INDEX_WORKERS (الافتراضي: إعداد البوت)")
+    parser.add_argument("--seed", type=int, default=1447)
+    parser.add_argument("--workdir", help="مجلد البيانات (الافتراضي: مجلد مؤقت يُحذف بعد القياس)")
+    parser.add_argument("--keep", action="store_true", help="عدم حذف المجلد المؤقت")
+    parser.add_argument("--json", help="حفظ النتائج بصيغة JSON")
+    parser.add_argument("--verbose", action="store_true", help="إظهار رسائل البوت أثناء القياس")
+    return parser.parse_args(argv)
+
+# مجمع الفهرسة يستخدم spawn/forkserver فيُعاد استيراد هذا الملف في العمليات الفرعية
+if __name__ == "__main__":
+    run(parse_args())